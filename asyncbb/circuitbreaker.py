@@ -0,0 +1,160 @@
+import asyncio
+import collections
+import threading
+import time
+
+from .errors import ServiceUnavailableError
+from .log import log
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker:
+    """Tracks the outcome of calls to a backing service and fails fast
+    once too many of them are failing.
+
+    The breaker opens when at least `min_calls` calls were made in the
+    last `window` seconds and `failure_rate` of them raised one of
+    `exceptions` (e.g. connection errors and timeouts, other errors mean
+    the service responded and count as successes). While open, calls are
+    rejected with a `ServiceUnavailableError` until `reset_timeout`
+    seconds have passed, after which up to `half_open_calls` probe calls
+    are let through. The breaker closes again if they all succeed, or
+    reopens if any of them fail.
+
+    Used as a (sync or async) context manager around a call, or by
+    calling `allow` before and `record` after it. Safe to use from
+    executor threads"""
+
+    def __init__(self, name, *, exceptions=(Exception,), failure_rate=0.5, min_calls=20,
+                 window=10.0, reset_timeout=5.0, half_open_calls=1):
+        self.name = name
+        self.exceptions = exceptions
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self.opened_count = 0
+        self.rejected_count = 0
+        self._opened_at = None
+        self._probes = 0
+        self._probe_successes = 0
+        # per second [second, calls, failures] counts
+        self._buckets = collections.deque()
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """raises a `ServiceUnavailableError` if the call shouldn't be made"""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN:
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self.rejected_count += 1
+                    raise ServiceUnavailableError(self.name, retry_after=remaining)
+                log.info("Circuit breaker '{}' half open".format(self.name))
+                self.state = HALF_OPEN
+                self._probes = 0
+                self._probe_successes = 0
+            if self._probes >= self.half_open_calls:
+                self.rejected_count += 1
+                raise ServiceUnavailableError(self.name, retry_after=self.reset_timeout)
+            self._probes += 1
+
+    def record(self, exception=None):
+        """records the outcome of a call, `exception` being the exception
+        it raised (if any)"""
+        if exception is not None and isinstance(exception, self.exceptions):
+            failed = True
+        elif isinstance(exception, asyncio.CancelledError):
+            # the call was abandoned, so says nothing about the service
+            with self._lock:
+                if self.state == HALF_OPEN:
+                    self._probes = max(self._probes - 1, 0)
+            return
+        else:
+            failed = False
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed:
+                    self._open()
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_calls:
+                        log.info("Circuit breaker '{}' closed".format(self.name))
+                        self.state = CLOSED
+                        self._buckets.clear()
+                return
+            calls, failures = self._count(failed)
+            if self.state == CLOSED and failed and calls >= self.min_calls \
+               and failures / calls >= self.failure_rate:
+                self._open()
+
+    def _count(self, failed):
+        now = int(time.monotonic())
+        buckets = self._buckets
+        while buckets and buckets[0][0] <= now - self.window:
+            buckets.popleft()
+        if not buckets or buckets[-1][0] != now:
+            buckets.append([now, 0, 0])
+        bucket = buckets[-1]
+        bucket[1] += 1
+        if failed:
+            bucket[2] += 1
+        return sum(b[1] for b in buckets), sum(b[2] for b in buckets)
+
+    def _open(self):
+        if self.state != OPEN:
+            log.warning("Circuit breaker '{}' open".format(self.name))
+            self.opened_count += 1
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._buckets.clear()
+
+    def __enter__(self):
+        self.allow()
+        return self
+
+    def __exit__(self, extype, ex, tb):
+        self.record(ex)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, extype, ex, tb):
+        return self.__exit__(extype, ex, tb)
+
+    def stats(self):
+        with self._lock:
+            now = int(time.monotonic())
+            buckets = [b for b in self._buckets if b[0] > now - self.window]
+            calls = sum(b[1] for b in buckets)
+            failures = sum(b[2] for b in buckets)
+            return {
+                'state': self.state,
+                'calls': calls,
+                'failures': failures,
+                'failure_rate': failures / calls if calls else 0.0,
+                'opened_count': self.opened_count,
+                'rejected_count': self.rejected_count
+            }
+
+def breaker_from_config(name, config, exceptions):
+    """creates a `CircuitBreaker` using the options from the
+    `[circuit_breaker]` config section, returning None if it's disabled"""
+    if 'circuit_breaker' not in config:
+        return CircuitBreaker(name, exceptions=exceptions)
+    section = config['circuit_breaker']
+    if not section.getboolean('enabled', True):
+        return None
+    return CircuitBreaker(name, exceptions=exceptions,
+                          failure_rate=section.getfloat('failure_rate', 0.5),
+                          min_calls=section.getint('min_calls', 20),
+                          window=section.getfloat('window', 10.0),
+                          reset_timeout=section.getfloat('reset_timeout', 5.0),
+                          half_open_calls=section.getint('half_open_calls', 1))
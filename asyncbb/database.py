@@ -2,7 +2,8 @@ import asyncio
 import asyncpg
 import os
 from collections import ItemsView
-from .errors import DatabaseError
+from .deadline import handler_deadline
+from .errors import DatabaseError, DeadlineExceededError
 from .log import log
 
 class SafePool(asyncpg.pool.Pool):
@@ -40,8 +41,64 @@ def create_pool(dsn=None, *,
                     max_queries=max_queries, loop=loop, setup=setup,
                     **connect_kwargs)
 
+# pool options that may come through as strings from config files
+POOL_OPTIONS = {
+    'min_size': int,
+    'max_size': int,
+    'max_queries': int,
+    'max_inactive_connection_lifetime': float
+}
+
+def connection_config(db_config):
+    """returns the arguments from the database config that are suitable
+    for creating a single connection with `asyncpg.connect`"""
+    return {k: v for k, v in dict(db_config).items()
+            if k not in POOL_OPTIONS and k not in ('setup', 'init', 'loop')}
+
+def connections_in_use(pool):
+    """returns the number of connections currently acquired from the pool"""
+    if hasattr(pool, '_con_count'):
+        # pre 0.10.0
+        con_count = pool._con_count
+    else:
+        # post 0.10.0
+        con_count = len(pool._holders)
+    return con_count - pool._queue.qsize()
+
+async def close_pool(pool, timeout=None):
+    """Waits up to `timeout` seconds for any acquired connections (and
+    therefore any transactions in progress) to be released back to the
+    pool before closing it. If the timeout is reached the pool is
+    terminated, closing the remaining connections"""
+
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout if timeout is not None else None
+    while connections_in_use(pool) > 0 and (deadline is None or loop.time() < deadline):
+        await asyncio.sleep(0.05)
+    in_use = connections_in_use(pool)
+    if in_use > 0 and hasattr(pool, 'terminate'):
+        log.warning("Terminating database pool with {} connections still in use".format(in_use))
+        pool.terminate()
+        return
+    try:
+        remaining = max(deadline - loop.time(), 0) if deadline is not None else None
+        await asyncio.wait_for(pool.close(), remaining)
+    except asyncio.TimeoutError:
+        log.warning("Timed out closing database pool")
+        if hasattr(pool, 'terminate'):
+            pool.terminate()
+
 async def prepare_database(db_config):
 
+    db_config = dict(db_config)
+    for key, convert in POOL_OPTIONS.items():
+        if db_config.get(key) is not None:
+            db_config[key] = convert(db_config[key])
+    # make sure the pool can always be created with only the minimum
+    # size set (the default max_size is 10)
+    if 'min_size' in db_config and 'max_size' not in db_config:
+        db_config['max_size'] = max(db_config['min_size'], 10)
+
     connection_pool = await create_pool(**db_config)
     async with connection_pool.acquire() as con:
         await create_tables(con)
@@ -115,9 +172,22 @@ async def create_tables(con):
     if exception:
         raise exception
 
+# errors that mean the database is unavailable or overloaded, as opposed
+# to errors in the query. Counted as failures by the database circuit breaker
+BREAKER_ERRORS = tuple(e for e in (
+    OSError,
+    asyncio.TimeoutError,
+    getattr(asyncpg.exceptions, 'ConnectionDoesNotExistError', None),
+    getattr(asyncpg.exceptions, 'PostgresConnectionError', None),
+    getattr(asyncpg.exceptions, 'CannotConnectNowError', None),
+    getattr(asyncpg.exceptions, 'TooManyConnectionsError', None),
+    getattr(asyncpg.exceptions, 'QueryCanceledError', None)
+) if e is not None)
+
 class HandlerDatabasePoolContext():
 
-    __slots__ = ('timeout', 'handler', 'connection', 'transaction', 'autocommit', 'pool', 'done', 'callbacks')
+    __slots__ = ('timeout', 'handler', 'connection', 'transaction', 'autocommit', 'pool', 'done', 'callbacks',
+                 'breaker', 'deadline', 'failure')
 
     def __init__(self, handler, pool, autocommit=False, timeout=None):
         self.handler = handler
@@ -128,20 +198,71 @@ class HandlerDatabasePoolContext():
         self.transaction = None
         self.done = False
         self.callbacks = []
+        self.breaker = None
+        self.deadline = None
+        # the first error on the connection counted by the breaker
+        self.failure = None
 
     async def __aenter__(self):
         if self.connection is not None:
             raise DatabaseError("Connection already in progress")
-        self.connection = await self.pool.acquire(timeout=self.timeout)
-        self.transaction = self.connection.transaction()
-        await self.transaction.start()
+        if self.pool is None:
+            # the application may still be starting up in the background
+            await self.handler.application.wait_until_ready()
+            self.pool = self.handler.application.connection_pool
+        self.breaker = getattr(getattr(self.handler, 'application', None), 'database_breaker', None)
+        # limit the acquire and all queries to the time left for the request
+        self.deadline = handler_deadline(self.handler)
+        timeout = self.timeout
+        if self.deadline is not None:
+            timeout = self.deadline.timeout(timeout)
+        if self.breaker is not None:
+            # fail fast rather than queueing on the pool if the database
+            # is failing or timing out
+            self.breaker.allow()
+        try:
+            try:
+                self.connection = await self.pool.acquire(timeout=timeout)
+                self.transaction = self.connection.transaction()
+                await self.transaction.start()
+            except asyncio.TimeoutError:
+                if self.deadline is not None and self.deadline.expired:
+                    raise DeadlineExceededError() from None
+                raise
+        except BaseException as e:
+            if self.breaker is not None:
+                self.breaker.record(e)
+            raise
+        # the outcome of the queries is recorded once the connection is
+        # released, so each acquire is a single call for the breaker
         return self.connection
 
+    def _check_failure(self, e):
+        if self.breaker is not None and self.failure is None and isinstance(e, self.breaker.exceptions):
+            self.failure = e
+
+    async def _watch(self, coro):
+        try:
+            return await coro
+        except BaseException as e:
+            self._check_failure(e)
+            raise
+
+    def _run(self, fn, *args, timeout=None, **kwargs):
+        if self.deadline is not None:
+            timeout = self.deadline.timeout(timeout)
+            coro = self.deadline.wait(fn(*args, timeout=timeout, **kwargs))
+        else:
+            coro = fn(*args, timeout=timeout, **kwargs)
+        if self.breaker is not None:
+            coro = self._watch(coro)
+        return coro
+
     async def __aexit__(self, extype, ex, tb):
         try:
             if self.transaction:
                 if extype is not None or self.autocommit is False:
-                    await self.transaction.rollback()
+                    await self._watch(self.transaction.rollback())
                 elif self.autocommit:
                     await self.commit()
         finally:
@@ -149,14 +270,23 @@ class HandlerDatabasePoolContext():
             self.transaction = None
             self.connection = None
             self.done = True
-            await self.pool.release(con)
+            try:
+                await self.pool.release(con)
+            finally:
+                if self.breaker is not None:
+                    if self.failure is None and isinstance(ex, asyncio.CancelledError):
+                        # abandoned, which says nothing about the database
+                        self.breaker.record(ex)
+                    else:
+                        self.breaker.record(self.failure)
+                    self.failure = None
 
     async def commit(self, create_new_transaction=False):
         if self.transaction:
             try:
                 callbacks = self.callbacks[:]
                 self.callbacks.clear()
-                rval = await self.transaction.commit()
+                rval = await self._watch(self.transaction.commit())
                 for callback in callbacks:
                     f = callback()
                     if asyncio.iscoroutine(f):
@@ -179,25 +309,25 @@ class HandlerDatabasePoolContext():
 
     def execute(self, query: str, *args, timeout: float=None) -> str:
         if self.transaction:
-            return self.connection.execute(query, *args, timeout=timeout)
+            return self._run(self.connection.execute, query, *args, timeout=timeout)
         else:
             raise DatabaseError("No transaction in progress")
 
     def fetch(self, query, *args, timeout=None):
         if self.transaction:
-            return self.connection.fetch(query, *args, timeout=timeout)
+            return self._run(self.connection.fetch, query, *args, timeout=timeout)
         else:
             raise DatabaseError("No transaction in progress")
 
     def fetchval(self, query, *args, column=0, timeout=None):
         if self.transaction:
-            return self.connection.fetchval(query, *args, column=column, timeout=timeout)
+            return self._run(self.connection.fetchval, query, *args, column=column, timeout=timeout)
         else:
             raise DatabaseError("No transaction in progress")
 
     def fetchrow(self, query, *args, timeout=None):
         if self.transaction:
-            return self.connection.fetchrow(query, *args, timeout=timeout)
+            return self._run(self.connection.fetchrow, query, *args, timeout=timeout)
         else:
             raise DatabaseError("No transaction in progress")
 
@@ -241,7 +371,7 @@ class HandlerDatabasePoolContext():
         elif query_args is not None:
             raise DatabaseError("expected dict or list or None for query_args")
 
-        resp = await self.connection.execute(query, *arglist)
+        resp = await self._run(self.connection.execute, query, *arglist)
 
         if resp and resp[0].startswith("ERROR:"):
             raise DatabaseError(resp)
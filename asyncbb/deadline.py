@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+from .errors import DeadlineExceededError
+
+try:
+    import contextvars
+except ImportError:
+    # python < 3.7, deadlines are only available from the handler
+    contextvars = None
+
+class Deadline:
+    """The time by which a request must be finished.
+
+    `timeout` limits a timeout to the time left (raising a
+    `DeadlineExceededError` if there's none), and `wait` waits for an
+    awaitable within the time left. Calls waiting in `wait` are cancelled
+    when the deadline is cancelled (e.g. when the client disconnects), and
+    raise a `DeadlineExceededError`.
+
+    Uses `time.monotonic` so it can also be checked from executor threads"""
+
+    __slots__ = ('expires', 'cancelled', 'done', '_pending')
+
+    def __init__(self, timeout=None):
+        self.expires = time.monotonic() + timeout if timeout is not None else None
+        self.cancelled = False
+        # set once the request has finished
+        self.done = False
+        self._pending = set()
+
+    def remaining(self):
+        """returns the seconds left, or None if there's no time limit"""
+        if self.cancelled:
+            return 0.0
+        if self.expires is None:
+            return None
+        return max(self.expires - time.monotonic(), 0.0)
+
+    @property
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def timeout(self, timeout=None):
+        """returns the smaller of `timeout` and the time left"""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise DeadlineExceededError()
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
+
+    async def wait(self, awaitable, timeout=None):
+        """waits for `awaitable` for at most `timeout` or the time left,
+        raising a `DeadlineExceededError` if the deadline passes first"""
+        timeout = self.timeout(timeout)
+        future = asyncio.ensure_future(awaitable)
+        self._pending.add(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            if self.expired:
+                raise DeadlineExceededError() from None
+            raise
+        except asyncio.CancelledError:
+            # cancelled by `cancel`, raised as a normal exception so the
+            # handler still finishes (a CancelledError would escape
+            # tornado's error handling and leave the request unfinished)
+            if self.cancelled:
+                raise DeadlineExceededError() from None
+            raise
+        finally:
+            self._pending.discard(future)
+
+    def cancel(self):
+        """expires the deadline and cancels the calls waiting on it"""
+        self.cancelled = True
+        for future in list(self._pending):
+            future.cancel()
+
+if contextvars is not None:
+    _current_deadline = contextvars.ContextVar('asyncbb_deadline', default=None)
+
+    def set_deadline(deadline):
+        _current_deadline.set(deadline)
+
+    def current_deadline():
+        """returns the deadline of the request being run, if any"""
+        deadline = _current_deadline.get()
+        if deadline is not None and deadline.done:
+            # tornado may run later requests in the same context
+            return None
+        return deadline
+else:
+    def set_deadline(deadline):
+        pass
+
+    def current_deadline():
+        return None
+
+def handler_deadline(handler):
+    """returns the deadline for the handler's request, falling back to the
+    deadline from the current context"""
+    deadline = getattr(handler, 'deadline', None)
+    if deadline is None:
+        deadline = current_deadline()
+    return deadline
@@ -7,6 +7,24 @@ class JSONHTTPError(tornado.web.HTTPError):
         self.body = body
 
 
+class RateLimitExceededError(JSONHTTPError):
+    def __init__(self, retry_after=None):
+        super(RateLimitExceededError, self).__init__(status_code=429, log_message="rate_limit_exceeded",
+                                                     code="rate_limit_exceeded")
+        self.retry_after = retry_after
+
+class ServiceUnavailableError(JSONHTTPError):
+    def __init__(self, service, retry_after=None):
+        super(ServiceUnavailableError, self).__init__(status_code=503, log_message="{}_unavailable".format(service),
+                                                      code="service_unavailable")
+        self.service = service
+        self.retry_after = retry_after
+
+class DeadlineExceededError(JSONHTTPError):
+    def __init__(self):
+        super(DeadlineExceededError, self).__init__(status_code=504, log_message="deadline_exceeded",
+                                                    code="deadline_exceeded")
+
 class DatabaseError(Exception):
     def __init__(self, response):
         self.message = response
@@ -53,3 +71,15 @@ class JsonRPCInternalError(JsonRPCError):
         super().__init__(request.get('id') if request else None,
                          -32603, "Internal Error", data,
                          'id' not in request if request else False)
+
+class JsonRPCRateLimitError(JsonRPCError):
+    def __init__(self, *, request=None, data=None):
+        super().__init__(request.get('id') if request else None,
+                         -32005, "Limit exceeded", data,
+                         'id' not in request if request else False)
+
+class JsonRPCServiceUnavailableError(JsonRPCError):
+    def __init__(self, *, request=None, data=None):
+        super().__init__(request.get('id') if request else None,
+                         -32006, "Service unavailable", data,
+                         'id' not in request if request else False)
@@ -0,0 +1,134 @@
+import asyncio
+import asyncpg
+import tornado.escape
+
+from .database import connection_config
+from .log import log
+
+class EventBus:
+    """Dispatches postgres NOTIFY messages to registered callbacks.
+
+    Listening uses a single dedicated connection, opened on the first call
+    to `listen` and kept outside of the application's connection pool, which
+    is re-established (and all channels re-subscribed) if it's lost.
+    Callbacks are called with `(channel, payload)` and may be coroutines.
+
+    Notifications sent while the connection is down are lost, so listeners
+    should treat events as hints (e.g. to invalidate a cache) rather than
+    as a guaranteed delivery mechanism"""
+
+    def __init__(self, db_config, pool=None, *, reconnect_delay=1.0, keepalive_interval=30.0):
+        self.db_config = connection_config(db_config)
+        self.pool = pool
+        self.reconnect_delay = reconnect_delay
+        self.keepalive_interval = keepalive_interval
+        self.listeners = {}
+        self.connection = None
+        self._lock = asyncio.Lock()
+        self._watcher = None
+        self._closed = False
+
+    async def _get_connection(self):
+        async with self._lock:
+            if self.connection is None or self.connection.is_closed():
+                await self._connect()
+            return self.connection
+
+    async def _connect(self):
+        delay = self.reconnect_delay
+        while not self._closed:
+            try:
+                self.connection = await asyncpg.connect(**self.db_config)
+                break
+            except Exception:
+                log.exception("Unable to connect event bus listener, retrying in {}s".format(delay))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+        if self._closed:
+            return
+        for channel in self.listeners:
+            await self.connection.add_listener(channel, self._dispatch)
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.ensure_future(self._watch())
+
+    async def _watch(self):
+        # asyncpg doesn't notify listeners when the connection drops, so
+        # check it periodically and reconnect when needed
+        while not self._closed:
+            await asyncio.sleep(self.keepalive_interval)
+            try:
+                async with self._lock:
+                    await self.connection.fetchval("SELECT 1")
+            except Exception:
+                if self._closed:
+                    break
+                log.warning("Event bus listener connection lost, reconnecting")
+                async with self._lock:
+                    if not self.connection.is_closed():
+                        self.connection.terminate()
+                    await self._connect()
+
+    async def listen(self, channel, callback):
+        callbacks = self.listeners.setdefault(channel, [])
+        if callback in callbacks:
+            return
+        callbacks.append(callback)
+        if len(callbacks) == 1:
+            con = await self._get_connection()
+            async with self._lock:
+                await con.add_listener(channel, self._dispatch)
+
+    async def unlisten(self, channel, callback):
+        callbacks = self.listeners.get(channel)
+        if not callbacks or callback not in callbacks:
+            return
+        callbacks.remove(callback)
+        if not callbacks:
+            del self.listeners[channel]
+            if self.connection is not None and not self.connection.is_closed():
+                async with self._lock:
+                    await self.connection.remove_listener(channel, self._dispatch)
+
+    def _dispatch(self, connection, pid, channel, payload):
+        for callback in list(self.listeners.get(channel, ())):
+            try:
+                f = callback(channel, payload)
+                if asyncio.iscoroutine(f):
+                    asyncio.ensure_future(f).add_done_callback(self._callback_done)
+            except Exception:
+                log.exception("Error in event bus callback for channel '{}'".format(channel))
+
+    def _callback_done(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            log.error("Error in event bus callback", exc_info=future.exception())
+
+    async def publish(self, channel, payload=None):
+        """Sends a notification on `channel`. Payloads that aren't strings
+        are json encoded"""
+        if payload is not None and not isinstance(payload, str):
+            payload = tornado.escape.json_encode(payload)
+        if self.pool is not None:
+            async with self.pool.acquire() as con:
+                await con.execute("SELECT pg_notify($1, $2)", channel, payload)
+        else:
+            con = await self._get_connection()
+            async with self._lock:
+                await con.execute("SELECT pg_notify($1, $2)", channel, payload)
+
+    async def publish_on_commit(self, db, channel, payload=None):
+        """Sends the notification as part of the given
+        `HandlerDatabasePoolContext` transaction. Postgres only delivers it
+        once the transaction commits (and drops it on rollback), and it
+        uses the transaction's connection rather than taking another one
+        from the pool"""
+        if payload is not None and not isinstance(payload, str):
+            payload = tornado.escape.json_encode(payload)
+        await db.execute("SELECT pg_notify($1, $2)", channel, payload)
+
+    async def close(self):
+        self._closed = True
+        if self._watcher is not None:
+            self._watcher.cancel()
+        if self.connection is not None and not self.connection.is_closed():
+            await self.connection.close()
+        self.connection = None
@@ -1,12 +1,47 @@
+import asyncio
+import gzip
+import io
+import logging
+import math
 import tornado.escape
 import tornado.web
 import traceback
+import zlib
 
-from .errors import JSONHTTPError
+from .errors import JSONHTTPError, RateLimitExceededError, ServiceUnavailableError
+from .deadline import Deadline, set_deadline, handler_deadline
 from .log import log
+from .ratelimit import get_store, acquire_limits, release_limits
+from .serialization import json_encode
 
 DEFAULT_JSON_ARGUMENT = object()
 
+def compress_body(body, encoding, level=6):
+    if encoding == 'gzip':
+        out = io.BytesIO()
+        # mtime is fixed so the same body always compresses the same way
+        with gzip.GzipFile(mode='wb', fileobj=out, compresslevel=level, mtime=0) as f:
+            f.write(body)
+        return out.getvalue()
+    return zlib.compress(body, level)
+
+def parse_accept_encoding(header):
+    """returns the set of encodings the client accepts"""
+    encodings = set()
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        name = name.strip().lower()
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if name:
+            encodings.add(name)
+    return encodings
+
 class JsonBodyMixin:
 
     @property
@@ -25,22 +60,180 @@ class JsonBodyMixin:
 
 class BaseHandler(JsonBodyMixin, tornado.web.RequestHandler):
 
+    # limits from `asyncbb.ratelimit` checked before handling each request
+    rate_limits = ()
+
+    # the `asyncbb.deadline.Deadline` for the request, if it has a timeout
+    deadline = None
+
     def prepare(self):
 
         # log the full request and headers if the log level is set to debug
-        if log.level == 10:
-            log.debug("Preparing request: {} {}".format(self.request.method, self.request.path))
-            for k, v in self.request.headers.items():
-                log.debug("{}: {}".format(k, v))
+        # (the headers are only formatted if the record is written)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Preparing request: %s %s\n%s", self.request.method, self.request.path, self.request.headers)
 
+        timeout = self.request_timeout()
+        if timeout is not None:
+            self.deadline = Deadline(timeout)
+            set_deadline(self.deadline)
+
+        if self.rate_limits:
+            return self._acquire_rate_limits()
         return super().prepare()
 
+    def request_timeout(self):
+        """returns the number of seconds the request has to complete, from
+        the `[general] request_timeout` config option and the header named
+        by `[general] deadline_header` (whichever is shorter), or None"""
+        config = self.application.config['general']
+        timeout = config.getfloat('request_timeout', None)
+        header = config.get('deadline_header')
+        if header and header in self.request.headers:
+            try:
+                requested = float(self.request.headers[header])
+            except ValueError:
+                requested = None
+            if requested is not None and requested > 0:
+                timeout = min(timeout, requested) if timeout is not None else requested
+        return timeout
+
+    async def _acquire_rate_limits(self):
+        scope = "{}.{}".format(type(self).__module__, type(self).__name__)
+        self._rate_limit_slots = await acquire_limits(
+            get_store(self.application), self.rate_limits, scope, self.request)
+
+    def on_connection_close(self):
+        # the client has gone away, so stop waiting on anything for it
+        if self.deadline is not None:
+            self.deadline.cancel()
+        super().on_connection_close()
+
+    def on_finish(self):
+        if self.deadline is not None:
+            self.deadline.done = True
+        slots = getattr(self, '_rate_limit_slots', None)
+        if slots:
+            self._rate_limit_slots = None
+            asyncio.ensure_future(release_limits(get_store(self.application), slots))
+        super().on_finish()
+
+    def write_json(self, value):
+        """Writes `value` as json. Unlike `write`, asyncpg Records (and
+        lists of them, e.g. the result of `fetch`) can be written directly
+        without converting each row to a dict first"""
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.write(json_encode(value).encode('ascii'))
+
+    def check_etag(self, etag):
+        """Sets the response's Etag and checks it against the request's
+        If-None-Match header. If it matches a 304 is sent and True is
+        returned, allowing handlers that can derive an etag cheaply (e.g.
+        from a version number) to skip building the response entirely"""
+        if not etag.startswith('"') and not etag.startswith('W/'):
+            etag = '"{}"'.format(etag)
+        self.set_header("Etag", etag)
+        if self.check_etag_header():
+            self.set_status(304)
+            self.finish()
+            return True
+        return False
+
+    def _response_encoding(self):
+        settings = getattr(self.application, 'compression', None)
+        if settings is None or self._status_code in (204, 304) or "Content-Encoding" in self._headers:
+            return None
+        ctype = self._headers.get("Content-Type", "").split(";")[0]
+        if not ctype.startswith("text/") and ctype not in tornado.web.GZipContentEncoding.CONTENT_TYPES:
+            return None
+        accepted = parse_accept_encoding(self.request.headers.get("Accept-Encoding", ""))
+        for encoding in ('gzip', 'deflate'):
+            if encoding in accepted:
+                return encoding
+        return None
+
+    def finish(self, chunk=None):
+        """Compresses the response body if the application has compression
+        enabled and the client accepts it. Bodies larger than the
+        `offload_size` are compressed in the application's executor, in
+        which case the request is finished once that is complete"""
+
+        if getattr(self, '_compressing', False):
+            raise RuntimeError("finish() called twice")
+        if self._finished or self._headers_written:
+            return super().finish(chunk)
+        if chunk is not None:
+            self.write(chunk)
+
+        encoding = self._response_encoding()
+        if encoding is None:
+            return super().finish()
+
+        self.add_header("Vary", "Accept-Encoding")
+        settings = self.application.compression
+        body = b"".join(self._write_buffer)
+        if len(body) < settings['min_size']:
+            return super().finish()
+
+        self._etag_encoding = encoding
+        etag = self._headers.get("Etag")
+        if etag is None:
+            if self._status_code == 200 and self.request.method in ("GET", "HEAD"):
+                # check the etag before compressing, so that cached
+                # clients don't cause the body to be compressed needlessly.
+                # tornado's finish sends the 304
+                self.set_etag_header()
+                if self.check_etag_header():
+                    self.clear_header("Etag")
+                    return super().finish()
+        elif etag.startswith('"'):
+            # an etag set by the handler (e.g. with `check_etag`) is the
+            # same for every encoding, so it's only a weak validator
+            self.set_header("Etag", "W/" + etag)
+
+        if len(body) < settings['offload_size']:
+            return self._finish_compressed(compress_body(body, encoding, settings['level']), encoding)
+
+        self._compressing = True
+        # finished once compressed, rather than by tornado once the
+        # handler returns
+        self._auto_finish = False
+
+        def done(future):
+            self._compressing = False
+            try:
+                self._finish_compressed(future.result(), encoding)
+            except Exception:
+                log.exception("Error finishing compressed response")
+
+        # not limited by the request's deadline, as the response is ready
+        self.application.asyncio_loop.run_in_executor(
+            self.application.executor, compress_body, body, encoding, settings['level']).add_done_callback(done)
+
+    def compute_etag(self):
+        """Computes the etag on the uncompressed body, adding the encoding
+        if the response is being compressed so that each encoding has its
+        own etag"""
+        etag = super().compute_etag()
+        encoding = getattr(self, '_etag_encoding', None)
+        if etag is None or encoding is None:
+            return etag
+        return '{}-{}"'.format(etag[:-1], encoding)
+
+    def _finish_compressed(self, body, encoding):
+        self._write_buffer = [body]
+        self.set_header("Content-Encoding", encoding)
+        self.set_header("Content-Length", len(body))
+        return super().finish()
+
     def write_error(self, status_code, **kwargs):
         """Overrides tornado's default error writing handler to return json data instead of a html template"""
         rval = {'type': 'error', 'payload': {}}
         if 'exc_info' in kwargs:
             # check exc type and if JSONHTTPError check for extra details
             exc_type, exc_value, exc_traceback = kwargs['exc_info']
+            if isinstance(exc_value, (RateLimitExceededError, ServiceUnavailableError)) and exc_value.retry_after:
+                self.set_header('Retry-After', math.ceil(exc_value.retry_after))
             if isinstance(exc_value, JSONHTTPError):
                 if exc_value.body is not None:
                     rval = exc_value.body
@@ -53,4 +246,21 @@ class BaseHandler(JsonBodyMixin, tornado.web.RequestHandler):
         self.write(rval)
 
     def run_in_executor(self, func, *args):
-        return self.application.asyncio_loop.run_in_executor(self.application.executor, func, *args)
+        """runs `func` in the application's executor, waiting at most until
+        the request's deadline (the function itself keeps running)"""
+        future = self.application.asyncio_loop.run_in_executor(self.application.executor, func, *args)
+        deadline = handler_deadline(self)
+        if deadline is None:
+            return future
+        return asyncio.ensure_future(deadline.wait(future))
+
+class ReadinessHandler(BaseHandler):
+    """Returns 200 once all the application's subsystems are up, or 503
+    while they are still starting. Intended to be mounted as the health
+    check used by load balancers to bring new instances into service"""
+
+    def get(self):
+        ready = getattr(self.application, 'ready', True)
+        if not ready:
+            self.set_status(503)
+        self.write({'ready': ready})
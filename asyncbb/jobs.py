@@ -0,0 +1,313 @@
+import asyncio
+import functools
+import time
+import tornado.escape
+
+from .log import log
+
+# jobs registered with the `job` decorator
+registry = {}
+
+def job(name=None):
+    """Registers the decorated function as a job, using the function's
+    name if `name` isn't given"""
+    def wrap(fn):
+        registry[name or fn.__name__] = fn
+        return fn
+    return wrap
+
+class JobQueueError(Exception):
+    pass
+
+class Job:
+
+    __slots__ = ('job_id', 'name', 'args', 'kwargs', 'attempts')
+
+    def __init__(self, job_id, name, payload, attempts):
+        self.job_id = job_id
+        self.name = name
+        payload = tornado.escape.json_decode(payload)
+        self.args = payload.get('args', [])
+        self.kwargs = payload.get('kwargs', {})
+        self.attempts = int(attempts)
+
+    def __repr__(self):
+        return "Job({}, {}, attempts={})".format(self.job_id, self.name, self.attempts)
+
+def _encode_payload(args, kwargs):
+    return tornado.escape.json_encode({'args': list(args), 'kwargs': kwargs})
+
+class PostgresJobStore:
+    """Stores jobs in the `asyncbb_jobs` table. Reserved jobs have their
+    `run_at` moved forward by the visibility timeout, so they become
+    available again if the worker running them dies"""
+
+    CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS asyncbb_jobs (
+        job_id BIGSERIAL PRIMARY KEY,
+        name VARCHAR NOT NULL,
+        payload VARCHAR NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        failed BOOLEAN NOT NULL DEFAULT FALSE,
+        run_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        created TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+    );
+    CREATE INDEX IF NOT EXISTS idx_asyncbb_jobs_run_at ON asyncbb_jobs (run_at) WHERE failed = FALSE;
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def setup(self):
+        async with self.pool.acquire() as con:
+            await con.execute(self.CREATE_TABLE)
+
+    async def push(self, name, payload, delay=0, connection=None):
+        query = "INSERT INTO asyncbb_jobs (name, payload, run_at) " \
+                "VALUES ($1, $2, NOW() + $3 * INTERVAL '1 second') RETURNING job_id"
+        if connection is not None:
+            return await connection.fetchval(query, name, payload, float(delay))
+        async with self.pool.acquire() as con:
+            return await con.fetchval(query, name, payload, float(delay))
+
+    async def reserve(self, count, visibility_timeout):
+        async with self.pool.acquire() as con:
+            rows = await con.fetch(
+                "UPDATE asyncbb_jobs SET run_at = NOW() + $2 * INTERVAL '1 second', attempts = attempts + 1 "
+                "WHERE job_id IN ("
+                "SELECT job_id FROM asyncbb_jobs WHERE failed = FALSE AND run_at <= NOW() "
+                "ORDER BY run_at LIMIT $1 FOR UPDATE SKIP LOCKED) "
+                "RETURNING job_id, name, payload, attempts",
+                count, float(visibility_timeout))
+        return [Job(row['job_id'], row['name'], row['payload'], row['attempts']) for row in rows]
+
+    async def complete(self, job):
+        async with self.pool.acquire() as con:
+            await con.execute("DELETE FROM asyncbb_jobs WHERE job_id = $1", job.job_id)
+
+    async def retry(self, job, delay):
+        async with self.pool.acquire() as con:
+            await con.execute("UPDATE asyncbb_jobs SET run_at = NOW() + $2 * INTERVAL '1 second' "
+                              "WHERE job_id = $1", job.job_id, float(delay))
+
+    async def fail(self, job):
+        async with self.pool.acquire() as con:
+            await con.execute("UPDATE asyncbb_jobs SET failed = TRUE WHERE job_id = $1", job.job_id)
+
+REDIS_PUSH_SCRIPT = """
+local job_id = redis.call('INCR', KEYS[1])
+redis.call('HMSET', KEYS[2] .. job_id, 'name', ARGV[1], 'payload', ARGV[2], 'attempts', 0)
+redis.call('ZADD', KEYS[3], ARGV[3], job_id)
+return job_id
+"""
+
+REDIS_RESERVE_SCRIPT = """
+local job_ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+local jobs = {}
+for _, job_id in ipairs(job_ids) do
+  redis.call('ZADD', KEYS[2], ARGV[1] + ARGV[3], job_id)
+  local attempts = redis.call('HINCRBY', KEYS[1] .. job_id, 'attempts', 1)
+  local job = redis.call('HMGET', KEYS[1] .. job_id, 'name', 'payload')
+  table.insert(jobs, {job_id, job[1], job[2], attempts})
+end
+return jobs
+"""
+
+class RedisJobStore:
+    """Stores jobs in redis. Like the postgres store, jobs are held in a
+    sorted set by the time they should run, and reserving a job moves that
+    forward by the visibility timeout. As the redis client is synchronous
+    all calls are run in the given executor"""
+
+    def __init__(self, connection_pool, executor=None, prefix='asyncbb:jobs'):
+        import redis
+        self.redis = redis.StrictRedis(connection_pool=connection_pool)
+        self.executor = executor
+        self.prefix = prefix
+        self._push = self.redis.register_script(REDIS_PUSH_SCRIPT)
+        self._reserve = self.redis.register_script(REDIS_RESERVE_SCRIPT)
+
+    def _run(self, fn, *args, **kwargs):
+        return asyncio.get_event_loop().run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def setup(self):
+        pass
+
+    async def push(self, name, payload, delay=0, connection=None):
+        return int(await self._run(
+            self._push,
+            keys=[self.prefix + ':id', self.prefix + ':job:', self.prefix + ':queue'],
+            args=[name, payload, time.time() + delay]))
+
+    async def reserve(self, count, visibility_timeout):
+        rows = await self._run(
+            self._reserve,
+            keys=[self.prefix + ':job:', self.prefix + ':queue'],
+            args=[time.time(), count, visibility_timeout])
+        return [Job(int(job_id), name, payload, attempts) for job_id, name, payload, attempts in rows]
+
+    def _complete(self, job):
+        pipe = self.redis.pipeline()
+        pipe.zrem(self.prefix + ':queue', job.job_id)
+        pipe.delete('{}:job:{}'.format(self.prefix, job.job_id))
+        pipe.execute()
+
+    async def complete(self, job):
+        await self._run(self._complete, job)
+
+    async def retry(self, job, delay):
+        await self._run(self.redis.zadd, self.prefix + ':queue', time.time() + delay, job.job_id)
+
+    def _fail(self, job):
+        pipe = self.redis.pipeline()
+        pipe.zrem(self.prefix + ':queue', job.job_id)
+        pipe.rpush(self.prefix + ':failed', job.job_id)
+        pipe.execute()
+
+    async def fail(self, job):
+        await self._run(self._fail, job)
+
+class JobQueue:
+
+    def __init__(self, store=None, registry=registry):
+        self.store = store
+        self.registry = registry
+        self._workers = []
+
+    def job(self, name=None):
+        def wrap(fn):
+            self.registry[name or fn.__name__] = fn
+            return fn
+        return wrap
+
+    def _check_job(self, name):
+        if self.store is None:
+            raise JobQueueError("Job store is not ready")
+        if name not in self.registry:
+            raise JobQueueError("Unknown job: {}".format(name))
+
+    def _wakeup_workers(self):
+        for worker in self._workers:
+            worker.wakeup()
+
+    async def enqueue(self, name, *args, delay=0, connection=None, **kwargs):
+        """Adds a job to the queue. With the postgres store, passing a
+        `connection` inserts the job as part of that connection's current
+        transaction"""
+        self._check_job(name)
+        job_id = await self.store.push(name, _encode_payload(args, kwargs), delay, connection)
+        self._wakeup_workers()
+        return job_id
+
+    async def enqueue_on_commit(self, db, name, *args, delay=0, **kwargs):
+        """Adds the job to the queue as part of the given
+        `HandlerDatabasePoolContext` transaction. With the postgres store
+        the job is inserted in the transaction itself, so it's only run
+        once the transaction commits and is discarded if it's rolled back.
+        Other stores add the job after the transaction has been committed"""
+        self._check_job(name)
+        if isinstance(self.store, PostgresJobStore):
+            job_id = await self.store.push(name, _encode_payload(args, kwargs), delay, db)
+            db.on_commit(self._wakeup_workers)
+            return job_id
+        db.on_commit(functools.partial(self.enqueue, name, *args, delay=delay, **kwargs))
+
+class Worker:
+    """Runs jobs from the queue, `concurrency` at a time.
+
+    Failed jobs are retried with an exponential backoff (`backoff` **
+    attempts seconds, up to `max_backoff`) until they have been attempted
+    `max_attempts` times, at which point they are marked as failed. Jobs
+    taking longer than the `visibility_timeout` are cancelled and treated
+    as failures, as they may have been picked up by another worker.
+    Synchronous job functions are run in the `executor`"""
+
+    def __init__(self, queue, *, concurrency=4, poll_interval=1.0, visibility_timeout=60.0,
+                 max_attempts=5, backoff=2.0, max_backoff=3600.0, executor=None):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.executor = executor
+        self.running = set()
+        self._task = None
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self.queue._workers.append(self)
+            self._task = asyncio.ensure_future(self._run())
+        return self._task
+
+    def wakeup(self):
+        self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            free = self.concurrency - len(self.running)
+            jobs = []
+            if free > 0:
+                try:
+                    jobs = await self.queue.store.reserve(free, self.visibility_timeout)
+                except Exception:
+                    log.exception("Error reserving jobs")
+            for job in jobs:
+                task = asyncio.ensure_future(self._run_job(job))
+                self.running.add(task)
+                task.add_done_callback(self._job_done)
+            if jobs and len(jobs) == free:
+                # there may be more jobs waiting
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _job_done(self, task):
+        self.running.discard(task)
+        if not self._stopping:
+            self._wakeup.set()
+
+    async def _run_job(self, job):
+        fn = self.queue.registry.get(job.name)
+        try:
+            if fn is None:
+                raise JobQueueError("Unknown job: {}".format(job.name))
+            if asyncio.iscoroutinefunction(fn):
+                coro = fn(*job.args, **job.kwargs)
+            else:
+                coro = asyncio.get_event_loop().run_in_executor(
+                    self.executor, functools.partial(fn, *job.args, **job.kwargs))
+            await asyncio.wait_for(coro, self.visibility_timeout)
+        except Exception:
+            if job.attempts >= self.max_attempts:
+                log.exception("{} failed, giving up".format(job))
+                await self.queue.store.fail(job)
+            else:
+                delay = min(self.backoff ** job.attempts, self.max_backoff)
+                log.exception("{} failed, retrying in {}s".format(job, delay))
+                await self.queue.store.retry(job, delay)
+        else:
+            await self.queue.store.complete(job)
+
+    async def stop(self, timeout=None):
+        """Stops reserving new jobs and waits for the running ones to
+        finish. Jobs still running after the timeout are cancelled and will
+        be picked up again once their visibility timeout has passed"""
+        self._stopping = True
+        if self in self.queue._workers:
+            self.queue._workers.remove(self)
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        if self.running:
+            done, pending = await asyncio.wait(list(self.running), timeout=timeout)
+            for task in pending:
+                task.cancel()
@@ -2,7 +2,10 @@ import asyncio
 import json
 from tornado.escape import json_decode
 
-from .errors import JsonRPCError, JsonRPCInvalidParamsError, JsonRPCInternalError
+from .errors import JsonRPCError, JsonRPCInvalidParamsError, JsonRPCInternalError, JsonRPCRateLimitError
+from .errors import JsonRPCServiceUnavailableError, RateLimitExceededError, ServiceUnavailableError
+from .ratelimit import get_store, acquire_limits, release_limits
+from .serialization import json_encode
 
 def _parse_error(request, data=None):
     return {
@@ -47,7 +50,25 @@ def map_jsonrpc_arguments(map):
 
 class JsonRPCBase:
 
-    """Base class for building jsonrpc apis"""
+    """Base class for building jsonrpc apis
+
+    `rate_limits` are checked for each call, with the json rpc method
+    passed to the limit's key function. Subclasses that want to limit by
+    client ip or headers should set `request` to the tornado request, and
+    `application` if the application's rate limit store should be used"""
+
+    rate_limits = ()
+
+    # run the calls in a batch request concurrently, allowing lookups from
+    # each call to be batched together (see `asyncbb.loader`). Only enable
+    # this if the calls don't depend on running in order or share state
+    # such as the handler's database context
+    concurrent_batches = False
+
+    def encode(self, response):
+        """encodes a response as json, allowing methods to return asyncpg
+        Records (and lists of them) as their result"""
+        return json_encode(response)
 
     async def __call__(self, request):
 
@@ -59,11 +80,13 @@ class JsonRPCBase:
 
         # check batch request
         if isinstance(request, list):
-            resp = []
-            for r in request:
-                result = await self._handle_single_request(r)
-                if result:
-                    resp.append(result)
+            if self.concurrent_batches:
+                results = await asyncio.gather(*[self._handle_single_request(r) for r in request])
+            else:
+                results = []
+                for r in request:
+                    results.append(await self._handle_single_request(r))
+            resp = [result for result in results if result]
             # if all were notifications
             if not resp:
                 return None
@@ -102,16 +125,34 @@ class JsonRPCBase:
             args = []
             kwargs = {}
 
+        slots = None
+        if self.rate_limits:
+            scope = "{}.{}".format(type(self).__module__, type(self).__name__)
+            try:
+                slots = await acquire_limits(get_store(getattr(self, 'application', None)), self.rate_limits,
+                                             scope, getattr(self, 'request', None), method)
+            except RateLimitExceededError as e:
+                return JsonRPCRateLimitError(request=request, data={'id': 'rate_limit_exceeded',
+                                                                    'retry_after': e.retry_after}).format()
+
         try:
             result = fn(*args, **kwargs)
             if asyncio.iscoroutine(result):
                 result = await result
         except TypeError:
             return JsonRPCInvalidParamsError(request=request, data={'id': 'bad_arguments', 'message': "Bad Arguments"}).format()
+        except ServiceUnavailableError as e:
+            # e.g. a circuit breaker for the database or redis is open
+            return JsonRPCServiceUnavailableError(request=request, data={'id': 'service_unavailable',
+                                                                         'service': e.service,
+                                                                         'retry_after': e.retry_after}).format()
         except JsonRPCError as e:
             return e.format(request)
         except:
             return JsonRPCInternalError(request=request).format()
+        finally:
+            if slots:
+                await release_limits(get_store(getattr(self, 'application', None)), slots)
 
         # handle notification requests
         if 'id' not in request:
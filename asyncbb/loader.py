@@ -0,0 +1,114 @@
+import asyncio
+
+class DataLoader:
+    """Collects the keys requested with `load` during a single iteration
+    of the event loop and loads them with one call to `batch_load`, so
+    concurrent requests for rows by key share a single query.
+
+    `batch_load` is given a list of unique keys and must return a dict
+    mapping keys to values, keys missing from the result load as None"""
+
+    def __init__(self, batch_load=None, *, max_batch_size=1000):
+        if batch_load is not None:
+            self.batch_load = batch_load
+        self.max_batch_size = max_batch_size
+        self._queue = []
+        self._scheduled = False
+
+    async def batch_load(self, keys):
+        raise NotImplementedError
+
+    def load(self, key):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._queue.append((key, future))
+        if not self._scheduled:
+            self._scheduled = True
+            loop.call_soon(self._dispatch)
+        return future
+
+    def load_many(self, keys):
+        return asyncio.gather(*[self.load(key) for key in keys])
+
+    def _dispatch(self):
+        queue = self._queue
+        self._queue = []
+        self._scheduled = False
+        keys = {}
+        for key, future in queue:
+            keys.setdefault(key, []).append(future)
+        keys = list(keys.items())
+        for i in range(0, len(keys), self.max_batch_size):
+            asyncio.ensure_future(self._load_batch(keys[i:i + self.max_batch_size]))
+
+    async def _load_batch(self, batch):
+        try:
+            results = await self.batch_load([key for key, _ in batch])
+        except Exception as e:
+            for _, futures in batch:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for key, futures in batch:
+            value = results.get(key)
+            for future in futures:
+                if not future.done():
+                    future.set_result(value)
+
+class RowLoader(DataLoader):
+    """Loads rows from `table` by the `key` column with a single
+    `WHERE key = ANY($1)` query per batch.
+
+    `pool` may be the application, in which case its connection pool is
+    used once it's available, allowing loaders to be created before the
+    application has started. Rows are loaded using their own connection,
+    so they won't see changes from uncommitted transactions"""
+
+    def __init__(self, pool, table, key='pk', columns='*', **kwargs):
+        super().__init__(**kwargs)
+        self.pool = pool
+        self.key = key
+        self.query = "SELECT {} FROM {} WHERE {} = ANY($1)".format(columns, table, key)
+
+    async def batch_load(self, keys):
+        pool = getattr(self.pool, 'connection_pool', self.pool)
+        async with pool.acquire() as con:
+            rows = await con.fetch(self.query, keys)
+        return {row[self.key]: row for row in rows}
+
+class CachedLoader:
+    """Wraps a shared loader, caching the values it loads. Used to give
+    each request a consistent view of the rows it has loaded without
+    keeping them around between requests"""
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.cache = {}
+
+    def load(self, key):
+        future = self.cache.get(key)
+        if future is None or (future.done() and (future.cancelled() or future.exception() is not None)):
+            future = self.cache[key] = self.loader.load(key)
+        return future
+
+    def load_many(self, keys):
+        return asyncio.gather(*[self.load(key) for key in keys])
+
+    def clear(self, key=None):
+        if key is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(key, None)
+
+class LoaderMixin:
+
+    def loader(self, loader):
+        """returns a view of the shared `loader` which caches the values
+        loaded during this request"""
+        if not hasattr(self, '_loaders'):
+            self._loaders = {}
+        cached = self._loaders.get(loader)
+        if cached is None:
+            cached = self._loaders[loader] = CachedLoader(loader)
+        return cached
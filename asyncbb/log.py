@@ -1,7 +1,14 @@
+import asyncio
+import json
 import logging
+import logging.handlers
+import queue
+import random
 import tornado.httpclient
 import urllib
 
+from tornado.platform.asyncio import to_asyncio_future
+
 logging.basicConfig()
 log = logging.getLogger("asyncbb.log")
 
@@ -28,6 +35,9 @@ class SlackLogHandler(logging.Handler):
         }
         self.client_class = client_class
         self.min_level = level
+        # requests that haven't completed yet, so they can be waited on
+        # before shutting down
+        self.pending = set()
 
     def emit(self, record):
 
@@ -60,7 +70,15 @@ class SlackLogHandler(logging.Handler):
             endpoints = [endpoints]
         for endpoint in endpoints:
             request = tornado.httpclient.HTTPRequest(endpoint, method="POST", headers=None, body=body)
-            client.fetch(request, raise_error=False)
+            future = client.fetch(request, raise_error=False)
+            self.pending.add(future)
+            future.add_done_callback(self.pending.discard)
+
+    async def drain(self, timeout=None):
+        """Waits for any messages that are still being sent"""
+        if self.pending:
+            futures = [to_asyncio_future(f) for f in self.pending]
+            await asyncio.wait(futures, timeout=timeout)
 
 def configure_logger(logger, send_to_slack=True):
     """Used to configure a new logger using the defaults
@@ -71,3 +89,113 @@ def configure_logger(logger, send_to_slack=True):
         for handler in log.handlers:
             if isinstance(handler, SlackLogHandler):
                 logger.addHandler(handler)
+
+async def drain_log_handlers(logger, timeout=None):
+    """Waits up to `timeout` seconds for log messages still being
+    sent by the logger's slack handlers"""
+    handlers = [handler for handler in logger.handlers if isinstance(handler, SlackLogHandler)]
+    if handlers:
+        await asyncio.wait([asyncio.ensure_future(handler.drain(timeout)) for handler in handlers])
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as compact single line json objects"""
+
+    def format(self, record):
+        data = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc_info'] = record.exc_text
+        if record.stack_info:
+            data['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(data, separators=(',', ':'), default=str)
+
+class SamplingFilter(logging.Filter):
+    """Lets through `rate` (0 - 1) of the records below WARNING, so that
+    e.g. access logs for successful requests can be sampled without
+    losing any errors"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+# log arguments which can't change after the log call
+_PLAIN_TYPES = (str, bytes, int, float, bool, type(None))
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """Queues records to be formatted and written by a background thread.
+
+    Unlike the standard QueueHandler the message is only formatted before
+    it's queued if it has arguments which aren't plain values (and so may
+    change before the background thread gets to them, e.g. the request
+    headers). Records are dropped rather than blocking the caller if the
+    queue is full"""
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        args = record.args
+        if args and (not isinstance(args, tuple) or
+                     not all(isinstance(arg, _PLAIN_TYPES) for arg in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_listener = None
+
+def configure_async_logging(logger=None, *, json_format=False, max_queue_size=10000):
+    """Moves the handlers on `logger` (the root logger by default) to a
+    background thread, replacing them with a `QueueLogHandler`.
+
+    Slack handlers are left in place, as they send their messages using
+    the event loop"""
+
+    global _listener
+    if _listener is not None:
+        return _listener
+    if logger is None:
+        logger = logging.getLogger()
+
+    handlers = [handler for handler in logger.handlers if not isinstance(handler, SlackLogHandler)]
+    if json_format:
+        for handler in handlers:
+            handler.setFormatter(JSONFormatter())
+
+    q = queue.Queue(max_queue_size)
+    for handler in handlers:
+        logger.removeHandler(handler)
+    queue_handler = QueueLogHandler(q)
+    logger.addHandler(queue_handler)
+    _listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+    _listener.logger = logger
+    _listener.queue_handler = queue_handler
+    _listener.start()
+    return _listener
+
+def stop_async_logging():
+    """Writes any queued records, stops the background thread and puts
+    the original handlers back"""
+    global _listener
+    if _listener is not None:
+        _listener.logger.removeHandler(_listener.queue_handler)
+        _listener.stop()
+        for handler in _listener.handlers:
+            _listener.logger.addHandler(handler)
+        _listener = None
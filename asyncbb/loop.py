@@ -0,0 +1,103 @@
+import asyncio
+import os
+import tornado.ioloop
+import tornado.platform.asyncio
+
+from .log import log
+
+EVENT_LOOPS = ('asyncio', 'uvloop')
+
+# the loops installed when `asyncbb.web` is imported, which may be replaced
+# if the application config chooses a different event loop
+_installed_ioloop = None
+_installed_loop = None
+
+def _is_uvloop(obj):
+    return type(obj).__module__.split('.')[0] == 'uvloop'
+
+def _loop_name(loop):
+    return 'uvloop' if _is_uvloop(loop) else 'asyncio'
+
+def _resolve_event_loop(name):
+    """returns the event loop to use for `name`, defaulting to the
+    `EVENT_LOOP` environment variable and falling back to asyncio if the
+    requested one isn't available"""
+    if name is None:
+        name = os.environ.get('EVENT_LOOP', 'asyncio')
+    name = name.strip().lower()
+    if name not in EVENT_LOOPS:
+        log.warning("Unknown event loop '{}', using asyncio".format(name))
+        return 'asyncio'
+    if name == 'uvloop':
+        try:
+            import uvloop
+        except ImportError:
+            log.warning("uvloop is not installed, using the default asyncio event loop")
+            return 'asyncio'
+    return name
+
+def _set_event_loop_policy(name):
+    if name == 'uvloop':
+        import uvloop
+        if not isinstance(asyncio.get_event_loop_policy(), uvloop.EventLoopPolicy):
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    elif _is_uvloop(asyncio.get_event_loop_policy()):
+        asyncio.set_event_loop_policy(None)
+
+def install_event_loop_policy(name=None):
+    """Sets the asyncio event loop policy for `name` ('asyncio' or
+    'uvloop'), defaulting to the `EVENT_LOOP` environment variable. Falls
+    back to the default asyncio loop if the requested one isn't installed.
+    Returns the name of the loop that will be used"""
+    name = _resolve_event_loop(name)
+    _set_event_loop_policy(name)
+    return name
+
+def new_event_loop(name=None):
+    """Installs the event loop policy and returns a new loop from it, set
+    as the current loop. For use by worker processes"""
+    install_event_loop_policy(name)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop
+
+def _install_ioloop():
+    global _installed_ioloop, _installed_loop
+    # NOTE: must be done before app creation as the autoreloader will also install one
+    _installed_ioloop = tornado.platform.asyncio.AsyncIOMainLoop()
+    _installed_ioloop.install()
+    _installed_loop = _installed_ioloop.asyncio_loop
+
+def setup_event_loop(name=None):
+    """Installs the event loop policy and tornado's asyncio IOLoop.
+
+    The first call (when `asyncbb.web` is imported) uses the `EVENT_LOOP`
+    environment variable. Later calls (e.g. with the `event_loop` from the
+    application's config) replace the loop installed by the first call if
+    it's of a different type, as long as it isn't running and no other
+    loop has been set since. Otherwise a warning is logged and the current
+    loop is kept. Returns the name of the loop in use"""
+
+    if _installed_loop is None:
+        name = install_event_loop_policy(name)
+        _install_ioloop()
+        return name
+
+    name = _resolve_event_loop(name)
+    current = asyncio.get_event_loop()
+    if _loop_name(current) == name:
+        return name
+    if current is not _installed_loop or current.is_running() or \
+       tornado.ioloop.IOLoop.instance() is not _installed_ioloop or \
+       tornado.ioloop.IOLoop.current(instance=False) not in (None, _installed_ioloop):
+        log.warning("Can't switch to the {} event loop as the current {} loop is already in use".format(
+            name, _loop_name(current)))
+        return _loop_name(current)
+
+    _set_event_loop_policy(name)
+    tornado.ioloop.IOLoop.clear_current()
+    tornado.ioloop.IOLoop.clear_instance()
+    current.close()
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    _install_ioloop()
+    return name
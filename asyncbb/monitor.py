@@ -0,0 +1,135 @@
+import sys
+import threading
+import time
+import traceback
+import tornado.web
+
+from .log import log
+
+def frame_context(frame):
+    """Walks the stack outwards from `frame` looking for the request
+    handler and json rpc method being run. Returns a dict with the
+    `handler` class name, http `method` and `path`, and `rpc_method`
+    (any of which may be None)"""
+
+    context = {'handler': None, 'method': None, 'path': None, 'rpc_method': None}
+    while frame is not None:
+        local = frame.f_locals
+        if context['handler'] is None and isinstance(local.get('self'), tornado.web.RequestHandler):
+            handler = local['self']
+            context['handler'] = type(handler).__name__
+            context['method'] = handler.request.method
+            context['path'] = handler.request.path
+        if context['rpc_method'] is None and frame.f_code.co_name == '_handle_single_request' \
+           and isinstance(local.get('method'), str):
+            context['rpc_method'] = local['method']
+        frame = frame.f_back
+    return context
+
+def format_context(context):
+    parts = []
+    if context['handler']:
+        parts.append("{} {} {}".format(context['handler'], context['method'], context['path']))
+    if context['rpc_method']:
+        parts.append("rpc method: {}".format(context['rpc_method']))
+    return ', '.join(parts) or 'no request'
+
+class LoopMonitor:
+    """Measures how late the event loop runs a callback scheduled every
+    `interval` seconds, and runs a watchdog thread which logs the stack
+    of the code blocking the loop (along with the handler and route being
+    run) whenever the loop has been blocked for more than `threshold`
+    seconds.
+
+    Monitoring only happens while the loop is running: the watchdog
+    thread exits when the loop stops, and is restarted the next time it
+    runs"""
+
+    def __init__(self, loop, *, interval=0.5, threshold=0.1):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.avg_lag = 0.0
+        self.blocked_count = 0
+        self._expected = None
+        self._heartbeat = time.monotonic()
+        self._reported = None
+        self._handle = None
+        self._thread = None
+        self._running = False
+        self._paused = False
+        self._loop_thread_id = None
+
+    def start(self):
+        """starts monitoring once the loop is running"""
+        if self._running:
+            return
+        self._running = True
+        self._handle = self.loop.call_soon(self._resume)
+
+    def stop(self):
+        self._running = False
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _resume(self):
+        if self._thread is not None:
+            # make sure the previous watchdog has exited
+            self._thread.join()
+        self._paused = False
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._schedule()
+        self._thread = threading.Thread(target=self._watchdog, name="asyncbb-loop-monitor", daemon=True)
+        self._thread.start()
+
+    def _schedule(self):
+        self._expected = self.loop.time() + self.interval
+        self._handle = self.loop.call_at(self._expected, self._tick)
+
+    def _tick(self):
+        if self._paused:
+            # the loop was stopped since the last tick, which isn't lag
+            self._resume()
+            return
+        self.lag = max(self.loop.time() - self._expected, 0.0)
+        self.max_lag = max(self.max_lag, self.lag)
+        self.avg_lag = self.avg_lag * 0.9 + self.lag * 0.1
+        self._heartbeat = time.monotonic()
+        if self.lag > self.threshold:
+            log.warning("Event loop lag: {:.3f}s".format(self.lag))
+        if self._running:
+            self._schedule()
+
+    def _watchdog(self):
+        while self._running:
+            time.sleep(self.threshold / 2)
+            if not self.loop.is_running():
+                # not blocked, just stopped. resumed by the next tick
+                self._paused = True
+                return
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold or self._reported == heartbeat:
+                continue
+            # only report each blocking call once
+            self._reported = heartbeat
+            self.blocked_count += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = ''.join(traceback.format_stack(frame))
+            context = format_context(frame_context(frame))
+            del frame
+            log.warning("Event loop blocked for more than {:.3f}s ({}):\n{}".format(blocked, context, stack))
+
+    def stats(self):
+        return {
+            'lag': self.lag,
+            'max_lag': self.max_lag,
+            'avg_lag': self.avg_lag,
+            'blocked_count': self.blocked_count
+        }
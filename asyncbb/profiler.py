@@ -0,0 +1,128 @@
+import asyncio
+import collections
+import hmac
+import math
+import os
+import sys
+import threading
+import time
+
+from .errors import JSONHTTPError
+from .handlers import BaseHandler
+from .monitor import frame_context
+
+class SamplingProfiler:
+    """Samples the stack of the thread `thread_id` every `interval`
+    seconds from a background thread, counting each distinct stack.
+
+    Each stack is prefixed with the request handler and json rpc method
+    found in it, so time spent in shared code (e.g. the database helpers)
+    is attributed to the request that ran it. Only code running on the
+    thread is sampled, coroutines suspended waiting on io are not"""
+
+    def __init__(self, thread_id=None, interval=0.005, max_depth=200):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = collections.Counter()
+        self._labels = {}
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="asyncbb-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _label(self, code):
+        # labels are cached by code object as formatting them is the most
+        # expensive part of taking a sample
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = "{} ({}:{})".format(
+                code.co_name, os.path.basename(code.co_filename), code.co_firstlineno).replace(';', ':')
+        return label
+
+    def _run(self):
+        while self._running:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            f = frame
+            while f is not None and len(stack) < self.max_depth:
+                stack.append(self._label(f.f_code))
+                f = f.f_back
+            context = frame_context(frame)
+            del frame, f
+            stack.reverse()
+            if context['rpc_method']:
+                stack.insert(0, "rpc:{}".format(context['rpc_method']))
+            if context['handler']:
+                stack.insert(0, "handler:{}".format(context['handler']))
+            self.samples[';'.join(stack)] += 1
+
+    def collapsed(self):
+        """returns the samples in the collapsed stack format used by
+        flamegraph.pl and speedscope"""
+        return ''.join("{} {}\n".format(stack, count) for stack, count in sorted(self.samples.items()))
+
+class ProfilerHandler(BaseHandler):
+    """Profiles the event loop for `seconds` (default 10, at most
+    `max_seconds`), sampling every `interval` seconds, and returns the
+    collapsed stacks as text.
+
+    Requires the `[profiler] token` config option to be sent as a bearer
+    token in the Authorization header, and returns a 404 if it isn't set"""
+
+    max_seconds = 300
+    # the profiler thread is joined at the end of the profile, so it has to
+    # wake up regularly
+    max_interval = 0.1
+    _running = False
+
+    async def get(self):
+
+        token = self.application.config['profiler'].get('token') if 'profiler' in self.application.config else None
+        if not token:
+            raise JSONHTTPError(404)
+        if not hmac.compare_digest(self.request.headers.get('Authorization', ''), 'Bearer {}'.format(token)):
+            raise JSONHTTPError(401, code='unauthorized')
+
+        try:
+            seconds = float(self.get_query_argument('seconds', 10))
+            interval = float(self.get_query_argument('interval', 0.005))
+        except ValueError:
+            raise JSONHTTPError(400, code='bad_arguments')
+        # nan would pass through min and max unchanged
+        if not math.isfinite(seconds) or not math.isfinite(interval):
+            raise JSONHTTPError(400, code='bad_arguments')
+        seconds = min(seconds, self.max_seconds)
+        interval = min(max(interval, 0.001), self.max_interval)
+
+        if ProfilerHandler._running:
+            raise JSONHTTPError(409, code='profiler_running')
+        ProfilerHandler._running = True
+        profiler = SamplingProfiler(interval=interval)
+        try:
+            profiler.start()
+            # tornado can't run asyncio.sleep(0), which yields None
+            if seconds > 0:
+                await asyncio.sleep(seconds)
+        finally:
+            # joining the sampling thread may take up to `interval`, so
+            # avoid blocking the loop while it finishes
+            try:
+                await self.application.asyncio_loop.run_in_executor(None, profiler.stop)
+            finally:
+                ProfilerHandler._running = False
+
+        self.set_header("Content-Type", "text/plain; charset=UTF-8")
+        self.write(profiler.collapsed())
@@ -0,0 +1,203 @@
+import asyncio
+import time
+
+from .errors import RateLimitExceededError
+
+def key_by_ip(request, method=None):
+    return request.remote_ip if request is not None else None
+
+def key_by_header(name):
+    def key(request, method=None):
+        return request.headers.get(name) if request is not None else None
+    return key
+
+def key_by_method(request, method=None):
+    return method
+
+class TokenBucket:
+    """Allows an average of `rate` requests per second for each key,
+    with bursts of up to `burst` requests"""
+
+    def __init__(self, rate, burst=None, *, key=key_by_ip, methods=None, name=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self.key = key
+        self.methods = methods
+        self.name = name
+
+    async def acquire(self, store, key):
+        allowed, retry_after = await store.take_token(key, self.rate, self.burst)
+        if not allowed:
+            raise RateLimitExceededError(retry_after=retry_after)
+
+class ConcurrencyLimit:
+    """Allows at most `limit` requests in progress at the same time for
+    each key. `ttl` is how long a slot is held for if it's never released
+    (e.g. the process holding it dies) when using a shared store"""
+
+    def __init__(self, limit, *, key=key_by_ip, methods=None, name=None, ttl=60):
+        self.limit = int(limit)
+        self.ttl = int(ttl)
+        self.key = key
+        self.methods = methods
+        self.name = name
+
+    async def acquire(self, store, key):
+        if not await store.acquire_slot(key, self.limit, self.ttl):
+            raise RateLimitExceededError()
+        return key
+
+class MemoryRateLimitStore:
+    """Keeps the limit state in process, for single node deployments"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.slots = {}
+
+    async def take_token(self, key, rate, burst):
+        now = time.monotonic()
+        # buckets are moved to the end when used, so they're kept in the
+        # order they were last used in
+        state = self.buckets.pop(key, None)
+        if state is None:
+            tokens = burst
+            if len(self.buckets) >= self.max_keys:
+                self._prune(now)
+        else:
+            tokens, last, _ = state
+            tokens = min(burst, tokens + (now - last) * rate)
+        if tokens >= 1:
+            allowed, retry_after = True, 0
+            tokens -= 1
+        else:
+            allowed, retry_after = False, (1 - tokens) / rate
+        # along with the time the bucket will have refilled by
+        self.buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+        return allowed, retry_after
+
+    def _prune(self, now):
+        # drop the buckets that have refilled, as they are
+        # indistinguishable from new ones, then the least recently used
+        # ones if there are still too many
+        self.buckets = {k: v for k, v in self.buckets.items() if v[2] > now}
+        while len(self.buckets) >= self.max_keys:
+            del self.buckets[next(iter(self.buckets))]
+
+    async def acquire_slot(self, key, limit, ttl):
+        count = self.slots.get(key, 0)
+        if count >= limit:
+            return False
+        self.slots[key] = count + 1
+        return True
+
+    async def release_slot(self, key):
+        count = self.slots.get(key, 0) - 1
+        if count > 0:
+            self.slots[key] = count
+        else:
+            self.slots.pop(key, None)
+
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+  allowed = 1
+else
+  retry_after = (1 - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+ACQUIRE_SLOT_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+if count > tonumber(ARGV[1]) then
+  redis.call('DECR', KEYS[1])
+  return 0
+end
+return 1
+"""
+
+RELEASE_SLOT_SCRIPT = """
+if redis.call('DECR', KEYS[1]) <= 0 then
+  redis.call('DEL', KEYS[1])
+end
+return 1
+"""
+
+class RedisRateLimitStore:
+    """Keeps the limit state in redis so limits apply across all the
+    nodes in a cluster. Each check is a single script call, run in the
+    given executor as the redis client is synchronous"""
+
+    def __init__(self, connection_pool, executor=None):
+        import redis
+        self.redis = redis.StrictRedis(connection_pool=connection_pool)
+        self.executor = executor
+        self._take_token = self.redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self._acquire_slot = self.redis.register_script(ACQUIRE_SLOT_SCRIPT)
+        self._release_slot = self.redis.register_script(RELEASE_SLOT_SCRIPT)
+
+    def _run(self, script, keys, args):
+        return asyncio.get_event_loop().run_in_executor(
+            self.executor, lambda: script(keys=keys, args=args))
+
+    async def take_token(self, key, rate, burst):
+        allowed, retry_after = await self._run(self._take_token, [key], [rate, burst, time.time()])
+        return bool(int(allowed)), float(retry_after)
+
+    async def acquire_slot(self, key, limit, ttl):
+        return bool(int(await self._run(self._acquire_slot, [key], [limit, ttl])))
+
+    async def release_slot(self, key):
+        await self._run(self._release_slot, [key], [])
+
+_default_store = MemoryRateLimitStore()
+
+def get_store(application):
+    """returns the application's store, or a process wide in memory store
+    if the application doesn't provide one"""
+    store = getattr(application, 'rate_limit_store', None)
+    return store if store is not None else _default_store
+
+async def acquire_limits(store, limits, scope, request, method=None):
+    """Checks each of the `limits` against the request, raising
+    `RateLimitExceededError` if any of them are exceeded. Returns a list
+    of the concurrency slots that were acquired, which must be passed to
+    `release_limits` once the request is complete.
+
+    `scope` is used to namespace the limits that have no name (usually the
+    handler class name) and `method` is the json rpc method being called,
+    if any"""
+
+    acquired = []
+    try:
+        for limit in limits:
+            if limit.methods is not None and method not in limit.methods:
+                continue
+            key = limit.key(request, method)
+            if key is None:
+                continue
+            key = "ratelimit:{}:{}:{}".format(limit.name or scope, type(limit).__name__, key)
+            slot = await limit.acquire(store, key)
+            if slot is not None:
+                acquired.append(slot)
+    except:
+        await release_limits(store, acquired)
+        raise
+    return acquired
+
+async def release_limits(store, acquired):
+    for slot in acquired:
+        await store.release_slot(slot)
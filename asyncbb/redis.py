@@ -1,5 +1,8 @@
 import redis
 
+from .deadline import handler_deadline
+from .errors import DeadlineExceededError, JSONHTTPError
+
 def build_redis_url(**dsn):
     if 'unix_socket_path' in dsn and dsn['unix_socket_path'] is not None:
         if 'password' in dsn and dsn['password'] is not None:
@@ -12,6 +15,9 @@ def build_redis_url(**dsn):
         return dsn['url']
     raise NotImplementedError
 
+# options handled by asyncbb rather than passed on to redis
+REDIS_STARTUP_OPTIONS = ('warmup_connections',)
+
 def prepare_redis(config):
     if 'unix_socket_path' in config:
         redis_connection_pool = redis.ConnectionPool(
@@ -25,13 +31,80 @@ def prepare_redis(config):
     else:
         redis_connection_pool = redis.ConnectionPool(
             decode_responses=True,
-            **config)
+            **{k: v for k, v in config.items() if k not in REDIS_STARTUP_OPTIONS})
     return redis_connection_pool
 
+def warmup_redis(connection_pool, count):
+    """Opens `count` connections in the pool ahead of time so the first
+    requests don't have to pay for the connection setup"""
+    connections = []
+    try:
+        for _ in range(count):
+            connection = connection_pool.get_connection('PING')
+            connections.append(connection)
+            connection.connect()
+    finally:
+        for connection in connections:
+            connection_pool.release(connection)
+
+# errors that mean redis is unavailable, as opposed to errors in the
+# command. Counted as failures by the redis circuit breaker
+BREAKER_ERRORS = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError, OSError)
+
+class HandlerRedis(redis.StrictRedis):
+    """A StrictRedis client which runs each command through the given
+    `CircuitBreaker`, and limits the time spent waiting for the response
+    to each command to the time left before the `Deadline`. Pipelines are
+    not checked"""
+
+    def __init__(self, *args, breaker=None, deadline=None, **kwargs):
+        super(HandlerRedis, self).__init__(*args, **kwargs)
+        self.breaker = breaker
+        self.deadline = deadline
+
+    def execute_command(self, *args, **options):
+        if self.breaker is None:
+            return self._execute_command(*args, **options)
+        with self.breaker:
+            return self._execute_command(*args, **options)
+
+    def _execute_command(self, *args, **options):
+        try:
+            return super(HandlerRedis, self).execute_command(*args, **options)
+        except redis.exceptions.TimeoutError:
+            if self.deadline is not None and self.deadline.expired:
+                raise DeadlineExceededError() from None
+            raise
+
+    def parse_response(self, connection, command_name, **options):
+        deadline = self.deadline
+        # the command has been sent, so the connection's socket is open
+        sock = getattr(connection, '_sock', None)
+        if deadline is None or deadline.done or sock is None:
+            return super(HandlerRedis, self).parse_response(connection, command_name, **options)
+        try:
+            timeout = deadline.timeout(connection.socket_timeout)
+        except DeadlineExceededError:
+            # the response won't be read, so the connection can't be reused
+            connection.disconnect()
+            raise
+        sock.settimeout(timeout)
+        try:
+            return super(HandlerRedis, self).parse_response(connection, command_name, **options)
+        finally:
+            # unless the connection was closed after an error
+            if getattr(connection, '_sock', None) is sock:
+                sock.settimeout(connection.socket_timeout)
+
 class RedisMixin:
 
     @property
     def redis(self):
         if not hasattr(self, '_redis'):
-            self._redis = redis.StrictRedis(connection_pool=self.application.redis_connection_pool)
+            if self.application.redis_connection_pool is None:
+                # redis is not configured or hasn't finished starting up
+                raise JSONHTTPError(503, "redis_unavailable", code="service_unavailable")
+            self._redis = HandlerRedis(connection_pool=self.application.redis_connection_pool,
+                                       breaker=getattr(self.application, 'redis_breaker', None),
+                                       deadline=handler_deadline(self))
         return self._redis
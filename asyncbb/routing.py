@@ -0,0 +1,165 @@
+import heapq
+import re
+
+from tornado.web import URLSpec
+
+# characters with a special meaning in regular expressions
+_SPECIAL = set('.^$*+?{}[]\\|()')
+_QUANTIFIERS = set('*+?{')
+
+def _has_top_level_alternation(pattern):
+    depth = 0
+    in_class = False
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 2
+            continue
+        if in_class:
+            if c == ']':
+                in_class = False
+        elif c == '[':
+            in_class = True
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            return True
+        i += 1
+    return False
+
+def analyse_pattern(pattern):
+    """Returns `(prefix, literal)` for a url regex, where `prefix` is the
+    literal text every matching path starts with, and `literal` is true if
+    the pattern only matches `prefix` itself"""
+
+    if _has_top_level_alternation(pattern):
+        return '', False
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+    if pattern.endswith('$') and not pattern.endswith('\\$'):
+        pattern = pattern[:-1]
+
+    prefix = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            if i + 1 < len(pattern) and not pattern[i + 1].isalnum():
+                c = pattern[i + 1]
+                i += 2
+            else:
+                # character classes like \d or backreferences
+                return ''.join(prefix), False
+        elif c in _SPECIAL:
+            return ''.join(prefix), False
+        else:
+            i += 1
+        if i < len(pattern) and pattern[i] in _QUANTIFIERS:
+            # the character is optional or repeated
+            return ''.join(prefix), False
+        prefix.append(c)
+    return ''.join(prefix), True
+
+def _literal_paths(pattern):
+    """returns the paths a pattern matches if it only matches literal
+    paths (including an optional trailing slash), otherwise None"""
+    if _has_top_level_alternation(pattern):
+        return None
+    stripped = pattern[:-1] if pattern.endswith('$') and not pattern.endswith('\\$') else pattern
+    for optional_slash in ('\\/?', '/?'):
+        if stripped.endswith(optional_slash):
+            prefix, literal = analyse_pattern(stripped[:-len(optional_slash)])
+            return [prefix, prefix + '/'] if literal else None
+    prefix, literal = analyse_pattern(pattern)
+    return [prefix] if literal else None
+
+class _TrieNode:
+
+    __slots__ = ('children', 'routes')
+
+    def __init__(self):
+        self.children = {}
+        self.routes = []
+
+class IndexedRouter:
+    """Finds the first `URLSpec` matching a path, as tornado does, without
+    trying each regex in turn.
+
+    Literal routes are looked up in a dict, routes with a literal prefix are
+    stored in a trie by that prefix so only those whose prefix matches the
+    path are tried, and the rest are always tried. Candidates are tried in
+    the order of the original list so the first matching route still wins.
+    The spec matched for each path is cached, up to `cache_size` paths"""
+
+    def __init__(self, specs, cache_size=1024):
+        self.size = len(specs)
+        self.cache_size = cache_size
+        self.cache = {}
+        self.literals = {}
+        self.trie = _TrieNode()
+        self.fallback = []
+
+        for index, spec in enumerate(specs):
+            if isinstance(spec, (tuple, list)):
+                spec = URLSpec(*spec)
+            route = (index, spec)
+            if spec.regex.flags & (re.IGNORECASE | re.VERBOSE):
+                self.fallback.append(route)
+                continue
+            paths = _literal_paths(spec.regex.pattern)
+            if paths is not None and not spec.regex.groups:
+                for path in paths:
+                    self.literals.setdefault(path, route)
+                continue
+            prefix, _ = analyse_pattern(spec.regex.pattern)
+            if not prefix:
+                self.fallback.append(route)
+                continue
+            node = self.trie
+            for c in prefix:
+                node = node.children.setdefault(c, _TrieNode())
+            node.routes.append(route)
+
+    def _candidates(self, path):
+        lists = []
+        node = self.trie
+        for c in path:
+            node = node.children.get(c)
+            if node is None:
+                break
+            if node.routes:
+                lists.append(node.routes)
+        if self.fallback:
+            lists.append(self.fallback)
+        return lists
+
+    def find(self, path):
+        """Returns `(spec, match)` for the first spec matching the path, or
+        None. `match` is None for specs without any groups"""
+
+        if path in self.cache:
+            spec = self.cache[path]
+            if spec is None:
+                return None
+            return spec, spec.regex.match(path) if spec.regex.groups else None
+
+        best = self.literals.get(path)
+        match = None
+        for index, spec in heapq.merge(*self._candidates(path)):
+            if best is not None and index > best[0]:
+                break
+            m = spec.regex.match(path)
+            if m:
+                best = (index, spec)
+                match = m
+                break
+
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[path] = best[1] if best is not None else None
+        if best is None:
+            return None
+        return best[1], match if best[1].regex.groups else None
@@ -0,0 +1,184 @@
+import datetime
+import decimal
+import json
+import uuid
+
+from json.encoder import encode_basestring_ascii
+
+try:
+    from asyncpg import Record
+except ImportError:
+    try:
+        from asyncpg.protocol.protocol import Record
+    except ImportError:
+        Record = None
+
+# the number of record shapes to keep plans for
+MAX_PLANS = 1024
+
+def _float(value):
+    if value != value or value in (float('inf'), float('-inf')):
+        # NaN and Infinity, as json.dumps writes them
+        return json.dumps(value)
+    return float.__repr__(value)
+
+def _quoted(fn):
+    def convert(value):
+        return '"' + fn(value) + '"'
+    return convert
+
+def _list(value):
+    if value and Record is not None and type(value[0]) is Record:
+        return _records(value)
+    return '[' + ', '.join([_encode(v) for v in value]) + ']'
+
+def _key(key):
+    """converts a dict key to a string the way `json.dumps` does"""
+    if isinstance(key, str):
+        return key
+    if key is True:
+        return 'true'
+    if key is False:
+        return 'false'
+    if key is None:
+        return 'null'
+    if isinstance(key, float):
+        return _float(key)
+    if isinstance(key, int):
+        return int.__repr__(key)
+    raise TypeError("keys must be str, int, float, bool or None, not {}".format(type(key).__name__))
+
+def _dict(value):
+    return '{' + ', '.join([encode_basestring_ascii(k if type(k) is str else _key(k)) + ': ' + _encode(v)
+                            for k, v in value.items()]) + '}'
+
+# types written as strings: decimals so they keep their precision, and
+# dates and uuids which json has no type for
+_strings = {
+    decimal.Decimal: str,
+    datetime.datetime: datetime.datetime.isoformat,
+    datetime.date: datetime.date.isoformat,
+    datetime.time: datetime.time.isoformat,
+    uuid.UUID: str
+}
+
+_converters = {
+    str: encode_basestring_ascii,
+    int: int.__repr__,
+    float: _float,
+    bool: lambda value: 'true' if value else 'false',
+    type(None): lambda value: 'null',
+    list: _list,
+    tuple: _list,
+    dict: _dict
+}
+_converters.update((cls, _quoted(fn)) for cls, fn in _strings.items())
+
+def _converter(cls):
+    """returns the function converting values of type `cls` to json,
+    looking through its bases for subclasses (e.g. asyncpg's UUID type)"""
+    fn = _converters.get(cls)
+    if fn is None:
+        if Record is not None and issubclass(cls, Record):
+            fn = _record
+        else:
+            for base in cls.__mro__[1:]:
+                if base in _converters:
+                    fn = _converters[base]
+                    break
+            else:
+                raise TypeError("Object of type {} is not JSON serializable".format(cls.__name__))
+        _converters[cls] = fn
+    return fn
+
+def _encode(value):
+    return _converter(type(value))(value)
+
+class _RecordPlan:
+    """The precomputed `"column": ` prefixes for a record shape, and the
+    converter for the type last seen in each column"""
+
+    __slots__ = ('names', 'prefixes', 'types', 'converters')
+
+    def __init__(self, names):
+        self.names = names
+        self.prefixes = [('{' if i == 0 else ', ') + encode_basestring_ascii(name) + ': '
+                         for i, name in enumerate(names)]
+        self.types = [None] * len(names)
+        self.converters = [None] * len(names)
+
+    def encode(self, record, parts):
+        if not self.prefixes:
+            parts.append('{}')
+            return
+        prefixes = self.prefixes
+        types = self.types
+        converters = self.converters
+        for i, value in enumerate(record):
+            cls = type(value)
+            if cls is not types[i]:
+                converters[i] = _converter(cls)
+                types[i] = cls
+            parts.append(prefixes[i])
+            parts.append(converters[i](value))
+        parts.append('}')
+
+_plans = {}
+
+def _plan(names):
+    plan = _plans.get(names)
+    if plan is None:
+        if len(_plans) >= MAX_PLANS:
+            _plans.clear()
+        plan = _plans[names] = _RecordPlan(names)
+    return plan
+
+def _record(record):
+    parts = []
+    _plan(tuple(record.keys())).encode(record, parts)
+    return ''.join(parts)
+
+def _records(records):
+    # rows from the same query share a shape, so the plan is only looked
+    # up again if a row has different columns
+    parts = ['[']
+    plan = None
+    for i, record in enumerate(records):
+        if i:
+            parts.append(', ')
+        if type(record) is not Record:
+            parts.append(_encode(record))
+            continue
+        names = tuple(record.keys())
+        if plan is None or names != plan.names:
+            plan = _plan(names)
+        plan.encode(record, parts)
+    parts.append(']')
+    return ''.join(parts)
+
+class _ContainsRecords(Exception):
+    pass
+
+def _default(value):
+    if Record is not None and isinstance(value, Record):
+        raise _ContainsRecords()
+    for cls in type(value).__mro__:
+        fn = _strings.get(cls)
+        if fn is not None:
+            return fn(value)
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
+
+def json_encode(value):
+    """JSON-encodes `value`, producing the same output as
+    `tornado.escape.json_encode`, but also encoding asyncpg Records (and
+    lists of them) directly, along with Decimals, datetimes and UUIDs
+    (as strings).
+
+    Values are encoded with `json`'s C encoder, only falling back to the
+    python encoder (with its per column plans for rows) when a Record is
+    found"""
+    try:
+        encoded = json.dumps(value, default=_default)
+    except _ContainsRecords:
+        encoded = _encode(value)
+    return encoded.replace("</", "<\\/")
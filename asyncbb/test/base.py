@@ -8,6 +8,7 @@ import warnings
 from tornado.platform.asyncio import AsyncIOLoop
 from tornado.testing import AsyncHTTPTestCase
 
+from asyncbb.loop import install_event_loop_policy
 from asyncbb.web import Application
 
 logging.basicConfig()
@@ -19,6 +20,8 @@ class AsyncHandlerTest(AsyncHTTPTestCase):
         return logging.getLogger(self.__class__.__name__)
 
     def get_new_ioloop(self):
+        # use the same event loop implementation as the application
+        install_event_loop_policy()
         io_loop = AsyncIOLoop()
         asyncio.set_event_loop(io_loop.asyncio_loop)
         return io_loop
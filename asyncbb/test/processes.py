@@ -1,4 +1,5 @@
-import select
+import os
+import selectors
 import subprocess
 import time
 
@@ -8,32 +9,35 @@ def wait_for_start_line(cmd, confirmed_line, watch='stdout', timeout=5):
     process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     pipe = getattr(process, watch)
     # wait until we get the "server started" message, otherwise tests
-    # may fail due to redis not having actually started yet
-    start_time = time.time()
-    if hasattr(select, 'epoll'):
-        poll = select.epoll()
-        poll.register(pipe, select.POLLIN)
-        while time.time() - timeout < start_time:
-            if poll.poll(0):
-                line = pipe.readline()
-                if confirmed_line in line:
-                    poll.unregister(pipe)
-                    return process
-        poll.unregister(pipe)
-    elif hasattr(select, 'kqueue'):
-        kq = select.kqueue()
-        kq.control([select.kevent(pipe, select.KQ_FILTER_READ, select.KQ_EV_ENABLE | select.KQ_EV_ADD)], 0, 0)
-        while time.time() - timeout < start_time:
-            if kq.control(None, 1, 1.):
-                line = pipe.readline()
-                if confirmed_line in line:
-                    kq.close()
-                    return process
-        kq.close()
-    else:
-        process.terminate()
-        raise Exception("No polling available")
+    # may fail due to redis not having actually started yet. the selector
+    # blocks until there's output (or the timeout passes) rather than
+    # spinning on the pipe. the output is read from the pipe's file
+    # descriptor directly, as lines read ahead into the pipe's buffer
+    # wouldn't wake the selector
+    fd = pipe.fileno()
+    buffered = b''
+    deadline = time.monotonic() + timeout
+    with selectors.DefaultSelector() as selector:
+        selector.register(fd, selectors.EVENT_READ)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not selector.select(remaining):
+                continue
+            data = os.read(fd, 4096)
+            if not data:
+                # the process closed the pipe (i.e. exited) before starting
+                process.wait()
+                raise Exception("process exited before starting: {}".format(
+                    process.stderr.read().decode('utf-8', 'replace').strip()))
+            lines = (buffered + data).split(b'\n')
+            # keep the last line until it's complete
+            buffered = lines.pop()
+            if any(confirmed_line in line for line in lines):
+                return process
     process.terminate()
+    process.wait()
     raise Exception("process took too long to start...")
 
 def shutdown_process(process):
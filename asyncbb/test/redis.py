@@ -1,11 +1,17 @@
 import asyncio
+import atexit
 import functools
-import shutil
+import os
 import uuid
 import redis
 
 from .processes import wait_for_start_line, shutdown_process
 
+# the number of logical databases in the shared test server. tests are
+# given each one in turn, so data left by a test (or work it started which
+# is still running) doesn't affect the tests directly after it
+REDIS_TEST_DATABASES = 16
+
 def gen_redis_config():
     """generates a redis config using a random unix socket"""
     socket_path = "/tmp/redis-testing.{}.sock".format(uuid.uuid4().hex)
@@ -16,42 +22,90 @@ def start_redis(config=None, timeout=5):
 
     if config is None:
         config = gen_redis_config()
-    redis_server_cmd = ["redis-server", "--unixsocket", config['unix_socket_path'], "--port", "0", "--loglevel", "warning"]
+    redis_server_cmd = ["redis-server", "--unixsocket", config['unix_socket_path'], "--port", "0", "--loglevel", "warning",
+                        "--databases", str(REDIS_TEST_DATABASES), "--save", "", "--appendonly", "no"]
     if 'password' in config:
         redis_server_cmd.extend(["--requirepass", "testing"])
 
-    process = wait_for_start_line(redis_server_cmd, "Server started")
+    process = wait_for_start_line(redis_server_cmd, "Server started", timeout=timeout)
 
-    process._post_terminate_cleanup = functools.partial(shutil.rmtree, config['unix_socket_path'], ignore_errors=True)
+    process._post_terminate_cleanup = functools.partial(_remove_socket, config['unix_socket_path'])
 
     return process, config
 
+def _remove_socket(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class RedisTestServer:
+    """A redis server shared by all the tests in the process, started the
+    first time it's needed and stopped when the process exits. Each test
+    gets its own (flushed) logical database, and the connection pool for
+    each database is reused between tests"""
+
+    def __init__(self):
+        self.process = None
+        self.config = None
+        self._next_db = 0
+        self._pools = {}
+        atexit.register(self.stop)
+
+    def start(self):
+        if self.process is None or self.process.poll() is not None:
+            self.process, self.config = start_redis()
+            self._pools.clear()
+        return self.config
+
+    def stop(self):
+        if self.process is not None:
+            for pool in self._pools.values():
+                pool.disconnect()
+            self._pools.clear()
+            shutdown_process(self.process)
+            self.process = None
+
+    def connection_pool(self, db):
+        pool = self._pools.get(db)
+        if pool is None:
+            pool = self._pools[db] = redis.ConnectionPool(
+                connection_class=redis.connection.UnixDomainSocketConnection,
+                decode_responses=True,
+                password=self.config.get('password'),
+                path=self.config['unix_socket_path'],
+                db=db)
+        return pool
+
+    def acquire_database(self):
+        """returns the config and connection pool for an empty database"""
+        self.start()
+        db = self._next_db
+        self._next_db = (db + 1) % REDIS_TEST_DATABASES
+        pool = self.connection_pool(db)
+        redis.StrictRedis(connection_pool=pool).flushdb()
+        return dict(self.config, db=str(db)), pool
+
+REDIS_TEST_SERVER = RedisTestServer()
+
 def requires_redis(func=None):
-    """Used to ensure all database connections are returned to the pool
-    before finishing the test"""
+    """Runs the test with an empty database on the shared test redis
+    server, setting the application's connection pool and `self.redis`"""
 
     def wrap(fn):
 
         async def wrapper(self, *args, **kwargs):
 
-            process, config = start_redis()
+            config, pool = REDIS_TEST_SERVER.acquire_database()
 
             self._app.config['redis'] = config
+            self._app.redis_connection_pool = pool
 
-            self._app.redis_connection_pool = redis.ConnectionPool(
-                connection_class=redis.connection.UnixDomainSocketConnection,
-                decode_responses=True,
-                password=config['password'] if 'password' in config else None,
-                path=config['unix_socket_path'])
-
-            self.redis = redis.StrictRedis(connection_pool=self._app.redis_connection_pool)
+            self.redis = redis.StrictRedis(connection_pool=pool)
 
-            try:
-                f = fn(self, *args, **kwargs)
-                if asyncio.iscoroutine(f):
-                    await f
-            finally:
-                shutdown_process(process)
+            f = fn(self, *args, **kwargs)
+            if asyncio.iscoroutine(f):
+                await f
 
         return wrapper
 
@@ -26,3 +26,11 @@ class RedisTest(AsyncHandlerTest):
 
         await self.fetch('/?key=TESTKEY&value=1')
         self.assertEqual(self.redis.get("TESTKEY"), '1')
+
+    @gen_test
+    @requires_redis
+    async def test_redis_database_is_empty(self):
+
+        # each test gets a flushed database on the shared server
+        self.assertEqual(self.redis.dbsize(), 0)
+        self.redis.set("TESTKEY", "2")
@@ -0,0 +1,252 @@
+import asyncio
+import redis
+import time
+import unittest
+
+from .base import AsyncHandlerTest
+from .redis import requires_redis
+
+from asyncbb.circuitbreaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from asyncbb.database import DatabaseMixin
+from asyncbb.errors import ServiceUnavailableError
+from asyncbb.handlers import BaseHandler
+from asyncbb.jsonrpc import JsonRPCBase
+from asyncbb.redis import RedisMixin
+from asyncbb.web import Application
+from tornado.escape import json_decode, json_encode
+from tornado.testing import gen_test
+
+def failing_call(breaker, exception=ConnectionError):
+    try:
+        with breaker:
+            raise exception()
+    except (exception, ServiceUnavailableError):
+        pass
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_opens_at_failure_rate(self):
+
+        breaker = CircuitBreaker('test', exceptions=(ConnectionError,), min_calls=4, failure_rate=0.5)
+        for _ in range(2):
+            with breaker:
+                pass
+        failing_call(breaker)
+        self.assertEqual(breaker.state, CLOSED)
+        failing_call(breaker)
+        self.assertEqual(breaker.state, OPEN)
+
+        with self.assertRaises(ServiceUnavailableError) as cm:
+            breaker.allow()
+        self.assertEqual(cm.exception.status_code, 503)
+        self.assertGreater(cm.exception.retry_after, 0)
+        self.assertEqual(breaker.stats()['rejected_count'], 1)
+
+    def test_ignores_other_errors(self):
+
+        breaker = CircuitBreaker('test', exceptions=(ConnectionError,), min_calls=2)
+        for _ in range(5):
+            failing_call(breaker, ValueError)
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(breaker.stats()['failures'], 0)
+
+    def test_half_open_probes(self):
+
+        breaker = CircuitBreaker('test', exceptions=(ConnectionError,), min_calls=1, reset_timeout=0.05)
+        failing_call(breaker)
+        self.assertEqual(breaker.state, OPEN)
+        time.sleep(0.06)
+
+        # only one probe is allowed through, and failing reopens the breaker
+        breaker.allow()
+        self.assertEqual(breaker.state, HALF_OPEN)
+        with self.assertRaises(ServiceUnavailableError):
+            breaker.allow()
+        breaker.record(ConnectionError())
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(breaker.opened_count, 2)
+
+        # a successful probe closes it
+        time.sleep(0.06)
+        with breaker:
+            pass
+        self.assertEqual(breaker.state, CLOSED)
+
+class BreakerHandler(BaseHandler):
+
+    def get(self):
+        self.application.test_breaker.allow()
+
+class BreakerRPC(JsonRPCBase):
+
+    def __init__(self, breaker):
+        self.breaker = breaker
+
+    def call(self):
+        self.breaker.allow()
+        return True
+
+class CircuitBreakerHandlerTest(AsyncHandlerTest):
+
+    def get_urls(self):
+        return [(r"^/?$", BreakerHandler)]
+
+    def get_app(self):
+        app = super().get_app()
+        app.test_breaker = CircuitBreaker('test', min_calls=1)
+        app.test_breaker.record(ConnectionError())
+        return app
+
+    @gen_test
+    async def test_open_breaker_returns_503(self):
+
+        resp = await self.fetch("/")
+        self.assertResponseCodeEqual(resp, 503)
+        self.assertIn('Retry-After', resp.headers)
+        self.assertEqual(json_decode(resp.body)['payload']['code'], 'service_unavailable')
+
+    @gen_test
+    async def test_open_breaker_jsonrpc_error(self):
+
+        rpc = BreakerRPC(self._app.test_breaker)
+        resp = await rpc(json_encode({"jsonrpc": "2.0", "method": "call", "id": 1}))
+        self.assertEqual(resp['error']['code'], -32006)
+        self.assertEqual(resp['error']['data']['service'], 'test')
+
+class FakeTransaction:
+
+    async def start(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+    async def commit(self):
+        pass
+
+class FakeConnection:
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def transaction(self):
+        return FakeTransaction()
+
+    async def fetchval(self, query, *args, column=0, timeout=None):
+        if self.pool.queries_failing:
+            raise ConnectionResetError()
+        return 1
+
+class FakePool:
+    """a database that can be made unavailable, or fail queries"""
+
+    def __init__(self):
+        self.available = True
+        self.queries_failing = False
+
+    async def acquire(self, timeout=None):
+        if not self.available:
+            raise ConnectionRefusedError()
+        return FakeConnection(self)
+
+    async def release(self, con):
+        pass
+
+class FakeDatabaseApplication(Application):
+
+    async def _start_database(self):
+        self.connection_pool = FakePool()
+
+class DatabaseHandler(DatabaseMixin, BaseHandler):
+
+    async def get(self):
+        async with self.db:
+            for _ in range(int(self.get_query_argument('queries', 1))):
+                await self.db.fetchval("SELECT 1")
+        self.set_status(204)
+
+class RedisHandler(RedisMixin, BaseHandler):
+
+    def get(self):
+        self.redis.set('key', 'value')
+        self.redis.get('key')
+        self.set_status(204)
+
+class BreakerIntegrationTest(AsyncHandlerTest):
+
+    def setUp(self):
+        super().setUp(extraconf={
+            'database': {'dsn': 'postgres://localhost/test'},
+            'redis': {'url': 'redis://localhost/0'},
+            'circuit_breaker': {'min_calls': 2, 'reset_timeout': 0.2, 'half_open_calls': 2}})
+
+    def get_urls(self):
+        return [(r"^/db/?$", DatabaseHandler),
+                (r"^/redis/?$", RedisHandler)]
+
+    def get_app(self):
+        return FakeDatabaseApplication(self.get_urls(), config=self._config, autoreload=False)
+
+    async def assertOpen(self, path, breaker):
+        self.assertEqual(breaker.state, OPEN)
+        resp = await self.fetch(path)
+        self.assertResponseCodeEqual(resp, 503)
+        self.assertIn('Retry-After', resp.headers)
+        self.assertEqual(json_decode(resp.body)['payload']['code'], 'service_unavailable')
+
+    @gen_test
+    async def test_database_breaker(self):
+
+        pool = self._app.connection_pool
+        breaker = self._app.database_breaker
+
+        pool.available = False
+        for _ in range(2):
+            resp = await self.fetch("/db")
+            self.assertResponseCodeEqual(resp, 500)
+        await self.assertOpen("/db", breaker)
+
+        # a request with several queries is a single probe
+        pool.available = True
+        await asyncio.sleep(0.2)
+        resp = await self.fetch("/db?queries=3")
+        self.assertResponseCodeEqual(resp, 204)
+        self.assertEqual(breaker.state, HALF_OPEN)
+        resp = await self.fetch("/db?queries=3")
+        self.assertResponseCodeEqual(resp, 204)
+        self.assertEqual(breaker.state, CLOSED)
+
+        # failing queries on an acquired connection open it too, and a
+        # failing probe reopens it
+        pool.queries_failing = True
+        for _ in range(2):
+            resp = await self.fetch("/db")
+            self.assertResponseCodeEqual(resp, 500)
+        await self.assertOpen("/db", breaker)
+        await asyncio.sleep(0.2)
+        resp = await self.fetch("/db")
+        self.assertResponseCodeEqual(resp, 500)
+        await self.assertOpen("/db", breaker)
+
+    @gen_test
+    @requires_redis
+    async def test_redis_breaker(self):
+
+        breaker = self._app.redis_breaker
+        pool = self._app.redis_connection_pool
+        self._app.redis_connection_pool = redis.ConnectionPool(
+            connection_class=redis.connection.UnixDomainSocketConnection,
+            path="/tmp/redis-testing.missing.sock")
+
+        for _ in range(2):
+            resp = await self.fetch("/redis")
+            self.assertResponseCodeEqual(resp, 500)
+        await self.assertOpen("/redis", breaker)
+
+        # each command is a probe
+        self._app.redis_connection_pool = pool
+        await asyncio.sleep(0.2)
+        resp = await self.fetch("/redis")
+        self.assertResponseCodeEqual(resp, 204)
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(self.redis.get('key'), 'value')
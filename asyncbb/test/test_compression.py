@@ -0,0 +1,120 @@
+import gzip
+
+from .base import AsyncHandlerTest
+
+from asyncbb.handlers import BaseHandler
+from tornado.testing import gen_test
+
+class Handler(BaseHandler):
+
+    def get(self):
+        size = int(self.get_query_argument('size'))
+        self.write({'data': ['x' * 100] * size})
+
+class FinishingHandler(Handler):
+
+    def get(self):
+        super().get()
+        self.finish()
+
+class DoubleFinishHandler(Handler):
+
+    errors = []
+
+    def get(self):
+        super().get()
+        self.finish()
+        try:
+            self.finish()
+        except RuntimeError as e:
+            self.errors.append(str(e))
+
+class VersionedHandler(BaseHandler):
+
+    def get(self):
+        if self.check_etag('v1'):
+            return
+        self.write({'version': 1, 'data': 'x' * int(self.get_query_argument('size', 0))})
+
+class CompressionTest(AsyncHandlerTest):
+
+    def setUp(self):
+        super().setUp(extraconf={'compression': {'min_size': 1024, 'offload_size': 10000}})
+
+    def get_urls(self):
+        return [(r'^/$', Handler), (r'^/finish$', FinishingHandler), (r'^/double$', DoubleFinishHandler),
+                (r'^/versioned$', VersionedHandler)]
+
+    @gen_test
+    async def test_compression(self):
+
+        # too small to compress
+        resp = await self.fetch('/?size=1', headers={'Accept-Encoding': 'gzip'}, decompress_response=False)
+        self.assertResponseCodeEqual(resp, 200)
+        self.assertNotIn('Content-Encoding', resp.headers)
+
+        # compressed on the loop and in the executor
+        for size in [20, 200]:
+            resp = await self.fetch('/?size={}'.format(size), headers={'Accept-Encoding': 'gzip'},
+                                    decompress_response=False)
+            self.assertResponseCodeEqual(resp, 200)
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertIn(b'x' * 100, gzip.decompress(resp.body))
+
+        resp = await self.fetch('/?size=20', headers={'Accept-Encoding': 'deflate, gzip;q=0'},
+                                decompress_response=False)
+        self.assertEqual(resp.headers['Content-Encoding'], 'deflate')
+
+    @gen_test
+    async def test_handler_finish_while_compressing(self):
+
+        resp = await self.fetch('/finish?size=200', headers={'Accept-Encoding': 'gzip'}, decompress_response=False)
+        self.assertResponseCodeEqual(resp, 200)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(resp.body), b'{"data": [' + b', '.join([b'"' + b'x' * 100 + b'"'] * 200) + b']}')
+
+    @gen_test
+    async def test_handler_finish_twice(self):
+
+        del DoubleFinishHandler.errors[:]
+        resp = await self.fetch('/double?size=200', headers={'Accept-Encoding': 'gzip'}, decompress_response=False)
+        self.assertResponseCodeEqual(resp, 200)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(DoubleFinishHandler.errors, ["finish() called twice"])
+
+    @gen_test
+    async def test_etag(self):
+
+        for size in [20, 200]:
+            url = '/?size={}'.format(size)
+            resp = await self.fetch(url, headers={'Accept-Encoding': 'gzip'}, decompress_response=False)
+            self.assertResponseCodeEqual(resp, 200)
+            etag = resp.headers['Etag']
+            self.assertTrue(etag.endswith('-gzip"'))
+            resp = await self.fetch(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag},
+                                    decompress_response=False)
+            self.assertResponseCodeEqual(resp, 304)
+            self.assertEqual(resp.headers['Etag'], etag)
+
+            # each encoding has its own etag
+            resp = await self.fetch(url, decompress_response=False)
+            self.assertResponseCodeEqual(resp, 200)
+            self.assertNotIn('Content-Encoding', resp.headers)
+            self.assertEqual(resp.headers['Etag'], etag[:-len('-gzip"')] + '"')
+            resp = await self.fetch(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': resp.headers['Etag']},
+                                    decompress_response=False)
+            self.assertResponseCodeEqual(resp, 200)
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+
+        resp = await self.fetch('/versioned', headers={'If-None-Match': '"v1"'})
+        self.assertResponseCodeEqual(resp, 304)
+        resp = await self.fetch('/versioned', headers={'If-None-Match': '"v0"'})
+        self.assertResponseCodeEqual(resp, 200)
+
+        # etags set by the handler are weak when the response is compressed
+        resp = await self.fetch('/versioned?size=2000', headers={'Accept-Encoding': 'gzip'}, decompress_response=False)
+        self.assertResponseCodeEqual(resp, 200)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.headers['Etag'], 'W/"v1"')
+        resp = await self.fetch('/versioned?size=2000', headers={'Accept-Encoding': 'gzip', 'If-None-Match': 'W/"v1"'})
+        self.assertResponseCodeEqual(resp, 304)
@@ -0,0 +1,165 @@
+import asyncio
+import redis
+import socket
+import time
+import unittest
+
+from .base import AsyncHandlerTest
+from .redis import requires_redis
+
+from asyncbb.deadline import Deadline
+from asyncbb.errors import DeadlineExceededError
+from asyncbb.handlers import BaseHandler
+from asyncbb.ratelimit import ConcurrencyLimit
+from asyncbb.redis import RedisMixin
+from tornado.escape import json_decode
+from tornado.iostream import IOStream
+from tornado.testing import gen_test
+
+class DeadlineTest(unittest.TestCase):
+
+    def test_timeout(self):
+
+        self.assertIsNone(Deadline().timeout())
+        self.assertEqual(Deadline().timeout(5), 5)
+        self.assertLessEqual(Deadline(1).timeout(5), 1)
+        self.assertEqual(Deadline(10).timeout(0.5), 0.5)
+
+        deadline = Deadline(0.01)
+        time.sleep(0.02)
+        self.assertTrue(deadline.expired)
+        with self.assertRaises(DeadlineExceededError):
+            deadline.timeout(5)
+
+    def test_cancel(self):
+
+        loop = asyncio.new_event_loop()
+        try:
+            deadline = Deadline()
+            future = asyncio.ensure_future(deadline.wait(asyncio.sleep(10)), loop=loop)
+            loop.call_later(0.01, deadline.cancel)
+            with self.assertRaises(DeadlineExceededError):
+                loop.run_until_complete(future)
+            self.assertTrue(deadline.expired)
+        finally:
+            loop.close()
+
+class SlowHandler(BaseHandler):
+
+    async def get(self):
+        await self.run_in_executor(time.sleep, float(self.get_query_argument('sleep')))
+        self.write({'timeout': self.deadline.timeout()})
+
+class WaitingHandler(BaseHandler):
+
+    rate_limits = [ConcurrencyLimit(1)]
+
+    async def get(self):
+        await self.deadline.wait(asyncio.sleep(float(self.get_query_argument('sleep'))))
+        self.write({'done': True})
+
+class RedisHandler(RedisMixin, BaseHandler):
+
+    def get(self):
+        self.write({'value': self.redis.blpop('queue', int(self.get_query_argument('wait')))})
+
+class DeadlineHandlerTest(AsyncHandlerTest):
+
+    def setUp(self):
+        super().setUp(extraconf={'general': {'debug': True,
+                                             'request_timeout': 0.2,
+                                             'deadline_header': 'X-Request-Timeout'}})
+
+    def get_urls(self):
+        return [(r"^/?$", SlowHandler),
+                (r"^/wait/?$", WaitingHandler)]
+
+    @gen_test
+    async def test_request_timeout(self):
+
+        resp = await self.fetch("/?sleep=0")
+        self.assertResponseCodeEqual(resp, 200)
+        self.assertLessEqual(json_decode(resp.body)['timeout'], 0.2)
+
+        resp = await self.fetch("/?sleep=0.5")
+        self.assertResponseCodeEqual(resp, 504)
+        self.assertEqual(json_decode(resp.body)['payload']['code'], 'deadline_exceeded')
+
+    @gen_test
+    async def test_deadline_header(self):
+
+        resp = await self.fetch("/?sleep=0.1", headers={'X-Request-Timeout': '0.05'})
+        self.assertResponseCodeEqual(resp, 504)
+
+        # the header can't extend the configured timeout
+        resp = await self.fetch("/?sleep=0", headers={'X-Request-Timeout': '10'})
+        self.assertResponseCodeEqual(resp, 200)
+        self.assertLessEqual(json_decode(resp.body)['timeout'], 0.2)
+
+class DisconnectTest(AsyncHandlerTest):
+
+    def setUp(self):
+        super().setUp(extraconf={'general': {'request_timeout': 5}})
+
+    def get_urls(self):
+        return [(r"^/wait/?$", WaitingHandler)]
+
+    @gen_test
+    async def test_disconnect(self):
+
+        stream = IOStream(socket.socket())
+        await stream.connect(('127.0.0.1', self.get_http_port()))
+        await stream.write(b"GET /wait?sleep=10 HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        while len(self._app._active_handlers) < 1:
+            await asyncio.sleep(0.01)
+        stream.close()
+
+        # the waiting call is cancelled and the request finishes
+        for _ in range(100):
+            if not self._app._active_handlers:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(len(self._app._active_handlers), 0)
+
+        # and its concurrency slot is released
+        resp = await self.fetch("/wait?sleep=0.01")
+        self.assertResponseCodeEqual(resp, 200)
+
+class RedisDeadlineTest(AsyncHandlerTest):
+
+    def setUp(self):
+        super().setUp(extraconf={'general': {'debug': True, 'request_timeout': 0.2},
+                                 'redis': {'url': 'redis://localhost/0'}})
+
+    def get_urls(self):
+        return [(r"^/?$", RedisHandler)]
+
+    @gen_test
+    async def test_unresponsive_redis(self):
+
+        # accepts connections (through the listen backlog) but never responds
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(8)
+        try:
+            self._app.redis_connection_pool = redis.ConnectionPool(port=server.getsockname()[1])
+            start = time.monotonic()
+            resp = await self.fetch("/?wait=0")
+            self.assertResponseCodeEqual(resp, 504)
+            self.assertLess(time.monotonic() - start, 1)
+        finally:
+            server.close()
+
+    @gen_test
+    @requires_redis
+    async def test_redis_deadline(self):
+
+        resp = await self.fetch("/?wait=5")
+        self.assertResponseCodeEqual(resp, 504)
+        self.assertEqual(json_decode(resp.body)['payload']['code'], 'deadline_exceeded')
+
+        # the connection waiting for the response isn't reused
+        self.redis.rpush('queue', 'value')
+        resp = await self.fetch("/?wait=1")
+        self.assertResponseCodeEqual(resp, 200)
+        self.assertEqual(json_decode(resp.body)['value'], ['queue', 'value'])
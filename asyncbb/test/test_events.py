@@ -0,0 +1,45 @@
+import asyncio
+
+from .base import AsyncHandlerTest
+from .database import requires_database
+
+from asyncbb.handlers import BaseHandler
+from asyncbb.database import DatabaseMixin
+from asyncbb.events import EventBus
+from tornado.testing import gen_test
+
+class Handler(DatabaseMixin, BaseHandler):
+
+    async def get(self):
+
+        async with self.db:
+            await self.application.event_bus.publish_on_commit(self.db, 'test_channel', {'key': 'value'})
+            if self.get_query_argument('rollback', None) is None:
+                await self.db.commit()
+
+        self.set_status(204)
+
+class EventBusTest(AsyncHandlerTest):
+
+    def get_urls(self):
+        return [(r'^/$', Handler)]
+
+    @gen_test
+    @requires_database
+    async def test_publish_on_commit(self):
+
+        self._app.event_bus = EventBus(self._app.config['database'], self.pool)
+        received = asyncio.Queue()
+        await self._app.event_bus.listen('test_channel', lambda channel, payload: received.put_nowait(payload))
+
+        try:
+            # nothing is sent if the transaction is rolled back
+            resp = await self.fetch('/?rollback=1')
+            self.assertResponseCodeEqual(resp, 204)
+            resp = await self.fetch('/')
+            self.assertResponseCodeEqual(resp, 204)
+            payload = await asyncio.wait_for(received.get(), 5)
+            self.assertEqual(payload, '{"key": "value"}')
+            self.assertTrue(received.empty())
+        finally:
+            await self._app.event_bus.close()
@@ -0,0 +1,70 @@
+import asyncio
+
+from .base import AsyncHandlerTest
+from .database import requires_database
+
+from asyncbb.handlers import BaseHandler
+from asyncbb.database import DatabaseMixin
+from asyncbb.jobs import JobQueue, Worker, PostgresJobStore
+from tornado.testing import gen_test
+
+results = []
+
+async def record(value):
+    results.append(value)
+
+attempts = []
+
+def fail_once(value):
+    attempts.append(value)
+    if len(attempts) == 1:
+        raise Exception("first attempt fails")
+    results.append(value)
+
+class Handler(DatabaseMixin, BaseHandler):
+
+    async def get(self):
+
+        value = self.get_query_argument('value')
+        async with self.db:
+            await self.application.job_queue.enqueue_on_commit(self.db, 'record', value)
+            if self.get_query_argument('rollback', None) is None:
+                await self.db.commit()
+
+        self.set_status(204)
+
+class JobQueueTest(AsyncHandlerTest):
+
+    def get_urls(self):
+        return [(r'^/$', Handler)]
+
+    @gen_test(timeout=30)
+    @requires_database
+    async def test_jobs(self):
+
+        results.clear()
+        store = PostgresJobStore(self.pool)
+        await store.setup()
+        self._app.job_queue = JobQueue(store, registry={'record': record, 'fail_once': fail_once})
+        worker = Worker(self._app.job_queue, poll_interval=0.1, backoff=0.1)
+        worker.start()
+
+        try:
+            # jobs enqueued in a transaction that's rolled back are discarded
+            resp = await self.fetch('/?value=0&rollback=1')
+            self.assertResponseCodeEqual(resp, 204)
+            resp = await self.fetch('/?value=1')
+            self.assertResponseCodeEqual(resp, 204)
+            await self._app.job_queue.enqueue('fail_once', '2')
+
+            for _ in range(50):
+                if len(results) == 2:
+                    break
+                await asyncio.sleep(0.1)
+            self.assertEqual(sorted(results), ['1', '2'])
+            self.assertEqual(len(attempts), 2)
+        finally:
+            await worker.stop()
+
+        async with self.pool.acquire() as con:
+            self.assertEqual(await con.fetchval("SELECT COUNT(*) FROM asyncbb_jobs"), 0)
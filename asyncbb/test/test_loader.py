@@ -0,0 +1,70 @@
+import asyncio
+
+from .base import AsyncHandlerTest
+from .database import requires_database
+
+from asyncbb.handlers import BaseHandler
+from asyncbb.jsonrpc import JsonRPCBase
+from asyncbb.loader import DataLoader, RowLoader, LoaderMixin
+from tornado.testing import gen_test
+
+class CountingLoader(DataLoader):
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    async def batch_load(self, keys):
+        self.batches.append(sorted(keys))
+        return {key: key * 2 for key in keys if key != 0}
+
+class RPC(JsonRPCBase):
+
+    concurrent_batches = True
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    async def double(self, value):
+        return await self.loader.load(value)
+
+class Handler(LoaderMixin, BaseHandler):
+
+    async def get(self):
+
+        loader = self.loader(self.application.store_loader)
+        rows = await loader.load_many(self.get_query_arguments('key'))
+        # loaded again from the request's cache
+        rows = await asyncio.gather(*[loader.load(key) for key in self.get_query_arguments('key')])
+        self.write({'values': [row['value'] if row else None for row in rows]})
+
+class LoaderTest(AsyncHandlerTest):
+
+    def get_urls(self):
+        return [(r'^/$', Handler)]
+
+    @gen_test
+    async def test_batching(self):
+
+        loader = CountingLoader()
+        results = await asyncio.gather(*[loader.load(i) for i in [1, 2, 2, 0, 3]])
+        self.assertEqual(results, [2, 4, 4, None, 6])
+        self.assertEqual(loader.batches, [[0, 1, 2, 3]])
+
+        loader = CountingLoader()
+        resp = await RPC(loader)([{"jsonrpc": "2.0", "method": "double", "params": [i], "id": i} for i in range(1, 4)])
+        self.assertEqual([r['result'] for r in resp], [2, 4, 6])
+        self.assertEqual(loader.batches, [[1, 2, 3]])
+
+    @gen_test
+    @requires_database
+    async def test_row_loader(self):
+
+        async with self.pool.acquire() as con:
+            await con.execute("CREATE TABLE store (key VARCHAR PRIMARY KEY, value VARCHAR)")
+            await con.execute("INSERT INTO store VALUES ('a', '1'), ('b', '2')")
+
+        self._app.store_loader = RowLoader(self._app, 'store', key='key')
+        resp = await self.fetch('/?key=a&key=b&key=c')
+        self.assertResponseCodeEqual(resp, 200)
+        self.assertEqual(resp.body, b'{"values": ["1", "2", null]}')
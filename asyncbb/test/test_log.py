@@ -0,0 +1,84 @@
+import io
+import json
+import logging
+import threading
+import unittest
+
+from asyncbb.log import configure_async_logging, stop_async_logging, JSONFormatter, SamplingFilter
+
+class RecordingHandler(logging.StreamHandler):
+    """records the thread each message was written from"""
+
+    def __init__(self):
+        super().__init__(io.StringIO())
+        self.threads = set()
+
+    def emit(self, record):
+        self.threads.add(threading.get_ident())
+        super().emit(record)
+
+    def lines(self):
+        return self.stream.getvalue().splitlines()
+
+class AsyncLoggingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger("asyncbb.test.log")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.handler = RecordingHandler()
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        stop_async_logging()
+        self.logger.removeHandler(self.handler)
+
+    def test_queued_logging(self):
+
+        configure_async_logging(self.logger)
+        self.assertNotIn(self.handler, self.logger.handlers)
+
+        headers = {'X-Header': 'before'}
+        self.logger.info("plain %s %d", "value", 1)
+        self.logger.info("headers: %s", headers)
+        # arguments that aren't plain values are formatted when logged
+        headers['X-Header'] = 'after'
+
+        stop_async_logging()
+        # the original handlers are restored
+        self.assertEqual(self.logger.handlers, [self.handler])
+        self.assertEqual(self.handler.lines(), ["plain value 1", "headers: {'X-Header': 'before'}"])
+        self.assertNotIn(threading.get_ident(), self.handler.threads)
+
+    def test_json_format(self):
+
+        configure_async_logging(self.logger, json_format=True)
+        try:
+            raise ValueError("bad value")
+        except ValueError:
+            self.logger.exception("failed: %s", "reason")
+        stop_async_logging()
+
+        data = json.loads(self.handler.lines()[0])
+        self.assertEqual(data['level'], 'ERROR')
+        self.assertEqual(data['logger'], 'asyncbb.test.log')
+        self.assertEqual(data['message'], 'failed: reason')
+        self.assertIn('ValueError: bad value', data['exc_info'])
+
+    def test_json_formatter(self):
+
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "%s", ("a\nb",), None)
+        line = JSONFormatter().format(record)
+        self.assertNotIn("\n", line)
+        self.assertEqual(json.loads(line)['message'], "a\nb")
+
+    def test_sampling_filter(self):
+
+        def record(level):
+            return logging.LogRecord("test", level, __file__, 1, "message", None, None)
+
+        self.assertFalse(SamplingFilter(0).filter(record(logging.INFO)))
+        self.assertTrue(SamplingFilter(0).filter(record(logging.WARNING)))
+        self.assertTrue(SamplingFilter(1).filter(record(logging.INFO)))
+        passed = sum(SamplingFilter(0.5).filter(record(logging.INFO)) for _ in range(1000))
+        self.assertTrue(350 < passed < 650)
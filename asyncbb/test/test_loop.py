@@ -0,0 +1,71 @@
+import asyncio
+import os
+import sys
+import types
+import unittest
+
+from unittest import mock
+
+# installs the import time loop, as the application would
+import asyncbb.web
+
+from asyncbb.loop import install_event_loop_policy, setup_event_loop
+
+class FakeUVLoopPolicy(asyncio.DefaultEventLoopPolicy):
+    pass
+
+# a stand in for uvloop, as it may not be installed
+fake_uvloop = types.ModuleType('uvloop')
+fake_uvloop.EventLoopPolicy = FakeUVLoopPolicy
+FakeUVLoopPolicy.__module__ = 'uvloop'
+
+class EventLoopPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = asyncio.get_event_loop_policy()
+
+    def tearDown(self):
+        asyncio.set_event_loop_policy(self.policy)
+
+    def test_policy_selection(self):
+
+        self.assertEqual(install_event_loop_policy('asyncio'), 'asyncio')
+        with mock.patch.dict(sys.modules, {'uvloop': fake_uvloop}):
+            self.assertEqual(install_event_loop_policy('UVLoop'), 'uvloop')
+            self.assertIsInstance(asyncio.get_event_loop_policy(), FakeUVLoopPolicy)
+            # and back again
+            self.assertEqual(install_event_loop_policy('asyncio'), 'asyncio')
+            self.assertNotIsInstance(asyncio.get_event_loop_policy(), FakeUVLoopPolicy)
+
+        with mock.patch.dict(os.environ, {'EVENT_LOOP': 'uvloop'}), \
+             mock.patch.dict(sys.modules, {'uvloop': fake_uvloop}):
+            self.assertEqual(install_event_loop_policy(), 'uvloop')
+
+    def test_fallback(self):
+
+        # uvloop not installed
+        with mock.patch.dict(sys.modules, {'uvloop': None}), \
+             self.assertLogs('asyncbb.log', 'WARNING') as logs:
+            self.assertEqual(install_event_loop_policy('uvloop'), 'asyncio')
+        self.assertIn("uvloop is not installed", logs.output[0])
+        self.assertNotIsInstance(asyncio.get_event_loop_policy(), FakeUVLoopPolicy)
+
+        with self.assertLogs('asyncbb.log', 'WARNING') as logs:
+            self.assertEqual(install_event_loop_policy('other'), 'asyncio')
+        self.assertIn("Unknown event loop", logs.output[0])
+
+    def test_keeps_callers_loop(self):
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            with mock.patch.dict(sys.modules, {'uvloop': fake_uvloop}), \
+                 self.assertLogs('asyncbb.log', 'WARNING') as logs:
+                self.assertEqual(setup_event_loop('uvloop'), 'asyncio')
+            self.assertIn("Can't switch to the uvloop event loop", logs.output[0])
+            self.assertIs(asyncio.get_event_loop(), loop)
+            self.assertFalse(loop.is_closed())
+            self.assertNotIsInstance(asyncio.get_event_loop_policy(), FakeUVLoopPolicy)
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
@@ -0,0 +1,90 @@
+import asyncio
+import time
+import unittest
+
+from .base import AsyncHandlerTest
+
+from asyncbb.handlers import BaseHandler
+from asyncbb.monitor import LoopMonitor
+from tornado.testing import gen_test
+
+class BlockingHandler(BaseHandler):
+
+    def get(self):
+        time.sleep(0.3)
+        self.set_status(204)
+
+class LoopMonitorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_lag(self):
+
+        monitor = LoopMonitor(self.loop, interval=0.05, threshold=0.1)
+        monitor.start()
+
+        async def block():
+            await asyncio.sleep(0.1)
+            time.sleep(0.25)
+            await asyncio.sleep(0.1)
+
+        try:
+            self.loop.run_until_complete(block())
+        finally:
+            monitor.stop()
+        stats = monitor.stats()
+        self.assertGreaterEqual(stats['max_lag'], 0.15)
+        self.assertGreater(stats['avg_lag'], 0)
+        self.assertEqual(stats['blocked_count'], 1)
+
+    def test_stopped_loop_is_not_blocked(self):
+
+        monitor = LoopMonitor(self.loop, interval=0.05, threshold=0.1)
+        monitor.start()
+        try:
+            self.loop.run_until_complete(asyncio.sleep(0.1))
+            # the watchdog exits while the loop isn't running
+            time.sleep(0.3)
+            self.assertFalse(monitor._thread.is_alive())
+            self.loop.run_until_complete(asyncio.sleep(0.2))
+            self.assertTrue(monitor._thread.is_alive())
+        finally:
+            monitor.stop()
+        stats = monitor.stats()
+        self.assertLess(stats['max_lag'], 0.1)
+        self.assertEqual(stats['blocked_count'], 0)
+
+        # stopping the monitor stops the watchdog
+        monitor._thread.join(1)
+        self.assertFalse(monitor._thread.is_alive())
+
+class BlockingHandlerTest(AsyncHandlerTest):
+
+    def setUp(self):
+        super().setUp(extraconf={'monitor': {'interval': 0.05, 'threshold': 0.1}})
+
+    def tearDown(self):
+        self._app.loop_monitor.stop()
+        super().tearDown()
+
+    def get_urls(self):
+        return [(r"^/block/?$", BlockingHandler)]
+
+    @gen_test
+    async def test_blocking_call_logged(self):
+
+        with self.assertLogs('asyncbb.log', 'WARNING') as logs:
+            resp = await self.fetch("/block")
+            self.assertResponseCodeEqual(resp, 204)
+            await asyncio.sleep(0.1)
+
+        blocked = [line for line in logs.output if 'Event loop blocked' in line]
+        self.assertEqual(len(blocked), 1)
+        # the handler and route, and the stack of the blocking call
+        self.assertIn("BlockingHandler GET /block", blocked[0])
+        self.assertIn("time.sleep(0.3)", blocked[0])
+        self.assertGreaterEqual(self._app.loop_monitor.stats()['max_lag'], 0.2)
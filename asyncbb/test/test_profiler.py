@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+from .base import AsyncHandlerTest
+
+from asyncbb.handlers import BaseHandler
+from asyncbb.profiler import ProfilerHandler
+from tornado.escape import json_decode
+from tornado.testing import gen_test
+
+class BusyHandler(BaseHandler):
+
+    def get(self):
+        time.sleep(0.2)
+        self.set_status(204)
+
+class ProfilerTest(AsyncHandlerTest):
+
+    def setUp(self):
+        super().setUp(extraconf={'profiler': {'token': 'secret'}})
+
+    def get_urls(self):
+        return [(r"^/profile/?$", ProfilerHandler),
+                (r"^/busy/?$", BusyHandler)]
+
+    @gen_test
+    async def test_authorization(self):
+
+        resp = await self.fetch("/profile?seconds=0")
+        self.assertResponseCodeEqual(resp, 401)
+        resp = await self.fetch("/profile?seconds=0", headers={'Authorization': 'Bearer wrong'})
+        self.assertResponseCodeEqual(resp, 401)
+        resp = await self.fetch("/profile?seconds=0", headers={'Authorization': 'Bearer secret'})
+        self.assertResponseCodeEqual(resp, 200)
+
+    @gen_test
+    async def test_bad_arguments(self):
+
+        for query in ["seconds=x", "seconds=nan", "interval=nan", "interval=inf", "seconds=-inf"]:
+            resp = await self.fetch("/profile?" + query, headers={'Authorization': 'Bearer secret'})
+            self.assertResponseCodeEqual(resp, 400)
+            self.assertEqual(json_decode(resp.body)['payload']['code'], 'bad_arguments')
+
+    @gen_test
+    async def test_profile(self):
+
+        profile = self.fetch("/profile?seconds=0.5&interval=60", headers={'Authorization': 'Bearer secret'})
+        await asyncio.sleep(0.05)
+
+        # only one profile can run at a time
+        resp = await self.fetch("/profile?seconds=0", headers={'Authorization': 'Bearer secret'})
+        self.assertResponseCodeEqual(resp, 409)
+
+        resp = await self.fetch("/busy")
+        self.assertResponseCodeEqual(resp, 204)
+
+        start = time.monotonic()
+        resp = await profile
+        self.assertResponseCodeEqual(resp, 200)
+        # the interval is capped, so finishing the profile is quick
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertIn("handler:BusyHandler", resp.body.decode('utf-8'))
+
+class ProfilerDisabledTest(AsyncHandlerTest):
+
+    def get_urls(self):
+        return [(r"^/profile/?$", ProfilerHandler)]
+
+    @gen_test
+    async def test_no_token(self):
+
+        resp = await self.fetch("/profile?seconds=0", headers={'Authorization': 'Bearer '})
+        self.assertResponseCodeEqual(resp, 404)
@@ -0,0 +1,157 @@
+import asyncio
+import time
+import unittest
+
+from .base import AsyncHandlerTest
+from .redis import requires_redis
+
+from asyncbb.handlers import BaseHandler
+from asyncbb.jsonrpc import JsonRPCBase
+from asyncbb.ratelimit import TokenBucket, ConcurrencyLimit, MemoryRateLimitStore, RedisRateLimitStore, \
+    key_by_header, key_by_method
+from tornado.testing import gen_test
+
+class LimitedHandler(BaseHandler):
+
+    rate_limits = [TokenBucket(1, 2, key=key_by_header('X-Client'))]
+
+    def get(self):
+        self.set_status(204)
+
+class RPC(JsonRPCBase):
+
+    rate_limits = [ConcurrencyLimit(1, key=key_by_method, methods=['slow']),
+                   TokenBucket(1, 1, key=key_by_method, methods=['fast'])]
+
+    def __init__(self):
+        self.released = asyncio.Event()
+        self.released.set()
+
+    def fast(self):
+        return True
+
+    async def slow(self):
+        await self.released.wait()
+        return True
+
+class MemoryRateLimitStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def take_token(self, store, key, rate, burst):
+        return self.loop.run_until_complete(store.take_token(key, rate, burst))[0]
+
+    def test_prune(self):
+
+        store = MemoryRateLimitStore(max_keys=2)
+        # a slow limit, which takes 100s to refill
+        self.assertTrue(self.take_token(store, 'slow', 0.01, 1))
+        time.sleep(0.02)
+        # a fast limit has refilled and is dropped, but pruning for it
+        # doesn't drop the slow limit's bucket
+        self.assertTrue(self.take_token(store, 'fast', 100, 1))
+        time.sleep(0.02)
+        self.assertTrue(self.take_token(store, 'other', 100, 1))
+        self.assertEqual(set(store.buckets), {'slow', 'other'})
+        self.assertFalse(self.take_token(store, 'slow', 0.01, 1))
+
+        # with no refilled buckets, the least recently used is dropped
+        self.assertTrue(self.take_token(store, 'next', 0.01, 1))
+        self.assertEqual(set(store.buckets), {'slow', 'next'})
+        self.assertFalse(self.take_token(store, 'slow', 0.01, 1))
+        self.assertTrue(self.take_token(store, 'last', 0.01, 1))
+        self.assertEqual(set(store.buckets), {'slow', 'last'})
+
+class RedisRateLimitStoreTest(AsyncHandlerTest):
+
+    def get_urls(self):
+        return []
+
+    @gen_test
+    @requires_redis
+    async def test_token_bucket(self):
+
+        store = RedisRateLimitStore(self._app.redis_connection_pool)
+        for _ in range(2):
+            allowed, retry_after = await store.take_token('key', 1, 2)
+            self.assertTrue(allowed)
+        allowed, retry_after = await store.take_token('key', 1, 2)
+        self.assertFalse(allowed)
+        self.assertGreater(retry_after, 0)
+        self.assertLessEqual(retry_after, 1)
+        # the bucket expires once it would have refilled
+        self.assertGreater(self.redis.ttl('key'), 0)
+        self.assertLessEqual(self.redis.ttl('key'), 3)
+
+        allowed, retry_after = await store.take_token('other', 1, 2)
+        self.assertTrue(allowed)
+
+    @gen_test
+    @requires_redis
+    async def test_concurrency_slots(self):
+
+        store = RedisRateLimitStore(self._app.redis_connection_pool)
+        self.assertTrue(await store.acquire_slot('key', 2, 60))
+        self.assertTrue(await store.acquire_slot('key', 2, 60))
+        self.assertFalse(await store.acquire_slot('key', 2, 60))
+        # rejected attempts don't hold a slot
+        self.assertEqual(self.redis.get('key'), '2')
+        self.assertGreater(self.redis.ttl('key'), 0)
+
+        await store.release_slot('key')
+        self.assertTrue(await store.acquire_slot('key', 2, 60))
+        for _ in range(2):
+            await store.release_slot('key')
+        self.assertIsNone(self.redis.get('key'))
+
+class RateLimitTest(AsyncHandlerTest):
+
+    def get_urls(self):
+        return [(r'^/$', LimitedHandler)]
+
+    @gen_test
+    async def test_token_bucket(self):
+
+        for _ in range(2):
+            resp = await self.fetch('/', headers={'X-Client': 'a'})
+            self.assertResponseCodeEqual(resp, 204)
+        resp = await self.fetch('/', headers={'X-Client': 'a'})
+        self.assertResponseCodeEqual(resp, 429)
+        self.assertIn('Retry-After', resp.headers)
+
+        # other clients aren't affected
+        resp = await self.fetch('/', headers={'X-Client': 'b'})
+        self.assertResponseCodeEqual(resp, 204)
+
+    @gen_test
+    async def test_jsonrpc_limits(self):
+
+        rpc = RPC()
+        resp = await rpc({"jsonrpc": "2.0", "method": "fast", "id": 1})
+        self.assertEqual(resp['result'], True)
+        resp = await rpc({"jsonrpc": "2.0", "method": "fast", "id": 2})
+        self.assertEqual(resp['error']['code'], -32005)
+
+        # concurrency slots are released after each call
+        for i in range(3):
+            resp = await rpc({"jsonrpc": "2.0", "method": "slow", "id": i})
+            self.assertEqual(resp['result'], True)
+
+        # a second call while one is in progress is rejected
+        rpc.released.clear()
+        held = asyncio.ensure_future(rpc({"jsonrpc": "2.0", "method": "slow", "id": 10}))
+        await asyncio.sleep(0.05)
+        self.assertFalse(held.done())
+        resp = await rpc({"jsonrpc": "2.0", "method": "slow", "id": 11})
+        self.assertEqual(resp['error']['code'], -32005)
+        self.assertEqual(resp['id'], 11)
+
+        rpc.released.set()
+        resp = await held
+        self.assertEqual(resp['result'], True)
+        resp = await rpc({"jsonrpc": "2.0", "method": "slow", "id": 12})
+        self.assertEqual(resp['result'], True)
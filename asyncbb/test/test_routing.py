@@ -0,0 +1,81 @@
+import unittest
+
+from .base import AsyncHandlerTest
+
+from asyncbb.handlers import BaseHandler
+from asyncbb.routing import IndexedRouter, analyse_pattern
+from tornado.testing import gen_test
+from tornado.web import URLSpec
+
+class Handler(BaseHandler):
+
+    def get(self, *args, **kwargs):
+        self.write({'name': self.__class__.__name__, 'args': args, 'kwargs': kwargs})
+
+class RootHandler(Handler):
+    pass
+
+class UserHandler(Handler):
+    pass
+
+class UserListHandler(Handler):
+    pass
+
+class CatchAllHandler(Handler):
+    pass
+
+URLS = [
+    (r"^/?$", RootHandler),
+    (r"^/v1/users/?$", UserListHandler),
+    (r"^/v1/users/(?P<user_id>[^/]+)/?$", UserHandler),
+    (r"^/v1/users/me$", UserListHandler),  # shadowed by the route above
+    (r"^/v1/(.+)/items$", Handler),
+    (r".*/catchall$", CatchAllHandler)
+]
+
+class RouterTest(unittest.TestCase):
+
+    def test_analyse_pattern(self):
+        self.assertEqual(analyse_pattern(r"^/v1/users$"), ("/v1/users", True))
+        self.assertEqual(analyse_pattern(r"^/v1/users/([^/]+)$"), ("/v1/users/", False))
+        self.assertEqual(analyse_pattern(r"^/v1\.0/a$"), ("/v1.0/a", True))
+        self.assertEqual(analyse_pattern(r"^/a/bc?$"), ("/a/b", False))
+        self.assertEqual(analyse_pattern(r"^/a|^/b$"), ("", False))
+        self.assertEqual(analyse_pattern(r"^/a/\d+$"), ("/a/", False))
+
+    def test_matches_linear_scan(self):
+
+        specs = [URLSpec(*url) for url in URLS]
+        router = IndexedRouter(specs)
+        paths = ["", "/", "//", "/v1/users", "/v1/users/", "/v1/users/me", "/v1/users/1/",
+                 "/v1/users/1/2", "/v1/things/items", "/v1/x/y/items", "/catchall",
+                 "/v1/users/catchall", "/unknown"]
+        for path in paths * 2:
+            expected = next((spec for spec in specs if spec.regex.match(path)), None)
+            route = router.find(path)
+            self.assertEqual(route[0] if route else None, expected, path)
+
+class IndexedRoutingTest(AsyncHandlerTest):
+
+    def setUp(self):
+        super().setUp(extraconf={'general': {'debug': True, 'indexed_routing': True}})
+
+    def get_urls(self):
+        return URLS
+
+    @gen_test
+    async def test_routing(self):
+
+        resp = await self.fetch('/')
+        self.assertResponseCodeEqual(resp, 200)
+        self.assertEqual(resp.body, b'{"name": "RootHandler", "args": [], "kwargs": {}}')
+
+        resp = await self.fetch('/v1/users/a%20b')
+        self.assertResponseCodeEqual(resp, 200)
+        self.assertEqual(resp.body, b'{"name": "UserHandler", "args": [], "kwargs": {"user_id": "a b"}}')
+
+        resp = await self.fetch('/v1/things/items')
+        self.assertEqual(resp.body, b'{"name": "Handler", "args": ["things"], "kwargs": {}}')
+
+        resp = await self.fetch('/unknown')
+        self.assertResponseCodeEqual(resp, 404)
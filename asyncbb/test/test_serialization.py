@@ -0,0 +1,93 @@
+import datetime
+import decimal
+import unittest
+import uuid
+
+from .base import AsyncHandlerTest
+from .database import requires_database
+
+from asyncbb.database import DatabaseMixin
+from asyncbb.handlers import BaseHandler
+from asyncbb.serialization import json_encode, _encode
+from tornado.escape import json_decode, json_encode as tornado_json_encode
+from tornado.testing import gen_test
+
+try:
+    from asyncpg.protocol.protocol import _create_record
+except ImportError:
+    _create_record = None
+
+class JsonEncodeTest(unittest.TestCase):
+
+    def test_matches_tornado(self):
+
+        for value in [{'a': [1, 2.5, None, True, 'x</yé']}, [], {}, "a\"b", [[1], [{'k': -1}]]]:
+            self.assertEqual(json_encode(value), tornado_json_encode(value))
+
+    def test_keys(self):
+
+        # non string keys are converted the way json converts them, in
+        # both the C encoder and the python encoder used with records
+        value = {None: 1, True: 2, False: 3, 1: 4, 2.5: 5, 'k': 6}
+        self.assertEqual(json_encode(value), tornado_json_encode(value))
+        self.assertEqual(_encode(value), tornado_json_encode(value))
+
+        with self.assertRaises(TypeError):
+            json_encode({(1, 2): 1})
+        with self.assertRaises(TypeError):
+            _encode({(1, 2): 1})
+
+    @unittest.skipIf(_create_record is None, "can't create asyncpg records")
+    def test_records(self):
+
+        rows = [_create_record({'id': 0, 'amount': 1}, (i, decimal.Decimal(i))) for i in range(3)]
+        self.assertEqual(json_decode(json_encode({'rows': rows, 'when': datetime.date(2020, 1, 2)})), {
+            'rows': [{'id': i, 'amount': str(i)} for i in range(3)],
+            'when': '2020-01-02'
+        })
+
+        # rows with the same number of columns but different names
+        rows = [_create_record({'a': 0}, (1,)), _create_record({'d': 0}, (4,)), _create_record({'a': 0}, (5,))]
+        self.assertEqual(json_decode(json_encode(rows)), [{'a': 1}, {'d': 4}, {'a': 5}])
+
+    def test_types(self):
+
+        self.assertEqual(json_decode(json_encode({
+            'd': decimal.Decimal('1.10'),
+            't': datetime.datetime(2020, 1, 2, 3, 4, 5),
+            'u': uuid.UUID(int=1)
+        })), {'d': '1.10', 't': '2020-01-02T03:04:05', 'u': '00000000-0000-0000-0000-000000000001'})
+
+        with self.assertRaises(TypeError):
+            json_encode(object())
+
+class RowsHandler(DatabaseMixin, BaseHandler):
+
+    async def get(self):
+
+        async with self.db:
+            rows = await self.db.fetch("SELECT i AS id, i * 1.5 AS amount, 'row ' || i AS name, "
+                                       "NULL AS missing, md5(i::text)::uuid AS uuid, "
+                                       "TIMESTAMP '2020-01-02 03:04:05' AS created "
+                                       "FROM generate_series(1, 3) AS i")
+        self.write_json({'rows': rows})
+
+class SerializationTest(AsyncHandlerTest):
+
+    def get_urls(self):
+        return [(r'^/$', RowsHandler)]
+
+    @gen_test
+    @requires_database
+    async def test_write_records(self):
+
+        resp = await self.fetch('/')
+        self.assertResponseCodeEqual(resp, 200)
+        rows = json_decode(resp.body)['rows']
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]['id'], 1)
+        self.assertEqual(rows[0]['amount'], '1.5')
+        self.assertEqual(rows[2]['name'], 'row 3')
+        self.assertIsNone(rows[1]['missing'])
+        self.assertEqual(len(rows[1]['uuid']), 36)
+        self.assertEqual(rows[0]['created'], '2020-01-02T03:04:05')
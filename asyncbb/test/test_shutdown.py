@@ -0,0 +1,96 @@
+import asyncio
+
+from .base import AsyncHandlerTest
+
+from asyncbb.database import close_pool
+from asyncbb.handlers import BaseHandler
+from tornado.testing import gen_test
+
+class WaitingHandler(BaseHandler):
+
+    async def get(self):
+        await self.application.request_released.wait()
+        self.write({'done': True})
+
+class FakePool:
+    """only has the attributes used by `close_pool`"""
+
+    def __init__(self, in_use):
+        self._holders = [object()] * 2
+        self._queue = asyncio.Queue()
+        for _ in range(2 - in_use):
+            self._queue.put_nowait(object())
+        self.closed = False
+        self.terminated = False
+
+    def release(self):
+        self._queue.put_nowait(object())
+
+    async def close(self):
+        self.closed = True
+
+    def terminate(self):
+        self.terminated = True
+
+class ShutdownTest(AsyncHandlerTest):
+
+    def get_app(self):
+        app = super().get_app()
+        app.request_released = asyncio.Event()
+        return app
+
+    def get_urls(self):
+        return [(r"^/?$", WaitingHandler)]
+
+    async def wait_for_active_requests(self, count):
+        while len(self._app._active_handlers) < count:
+            await asyncio.sleep(0.01)
+
+    @gen_test
+    async def test_shutdown_drains_requests(self):
+
+        request = self.fetch("/")
+        await self.wait_for_active_requests(1)
+
+        shutdown = asyncio.ensure_future(self._app.shutdown(timeout=5))
+        await asyncio.sleep(0.2)
+        self.assertFalse(shutdown.done())
+        self.assertFalse(self._app.ready)
+
+        self._app.request_released.set()
+        resp = await request
+        self.assertResponseCodeEqual(resp, 200)
+        await asyncio.wait_for(shutdown, 1)
+        self.assertEqual(len(self._app._active_handlers), 0)
+
+    @gen_test
+    async def test_shutdown_timeout(self):
+
+        request = self.fetch("/")
+        await self.wait_for_active_requests(1)
+
+        start = self.io_loop.time()
+        await asyncio.wait_for(self._app.shutdown(timeout=0.3), 2)
+        self.assertGreaterEqual(self.io_loop.time() - start, 0.3)
+        self.assertEqual(len(self._app._active_handlers), 1)
+
+        self._app.request_released.set()
+        await request
+
+    @gen_test
+    async def test_close_pool(self):
+
+        # waits for connections to be returned before closing
+        pool = FakePool(in_use=1)
+        self.io_loop.call_later(0.1, pool.release)
+        await close_pool(pool, 2)
+        self.assertTrue(pool.closed)
+        self.assertFalse(pool.terminated)
+
+        # terminates the pool if they aren't returned in time
+        pool = FakePool(in_use=1)
+        start = self.io_loop.time()
+        await close_pool(pool, 0.2)
+        self.assertGreaterEqual(self.io_loop.time() - start, 0.2)
+        self.assertTrue(pool.terminated)
+        self.assertFalse(pool.closed)
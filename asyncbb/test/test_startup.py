@@ -0,0 +1,89 @@
+import asyncio
+
+from .base import AsyncHandlerTest
+
+from asyncbb.database import DatabaseMixin
+from asyncbb.handlers import BaseHandler, ReadinessHandler
+from asyncbb.web import Application
+from tornado.escape import json_decode
+from tornado.testing import gen_test
+
+class FakeTransaction:
+
+    async def start(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+    async def commit(self):
+        pass
+
+class FakeConnection:
+
+    def transaction(self):
+        return FakeTransaction()
+
+    async def fetchval(self, query, *args, column=0, timeout=None):
+        return 1
+
+class FakePool:
+
+    async def acquire(self, timeout=None):
+        return FakeConnection()
+
+    async def release(self, con):
+        pass
+
+class SlowStartingApplication(Application):
+    """starts a fake database once `database_available` is set"""
+
+    async def _start_database(self):
+        await self.database_available.wait()
+        self.connection_pool = FakePool()
+
+class DatabaseHandler(DatabaseMixin, BaseHandler):
+
+    async def get(self):
+        async with self.db:
+            value = await self.db.fetchval("SELECT 1")
+        self.write({'value': value})
+
+class BackgroundStartupTest(AsyncHandlerTest):
+
+    def setUp(self):
+        super().setUp(extraconf={'general': {'debug': True, 'background_startup': True},
+                                 'database': {'dsn': 'postgres://localhost/test'}})
+
+    def get_app(self):
+        app = SlowStartingApplication(self.get_urls(), config=self._config, autoreload=False)
+        app.database_available = asyncio.Event()
+        return app
+
+    def get_urls(self):
+        return [(r"^/ready/?$", ReadinessHandler),
+                (r"^/db/?$", DatabaseHandler)]
+
+    @gen_test
+    async def test_background_startup(self):
+
+        self.assertFalse(self._app.ready)
+        resp = await self.fetch("/ready")
+        self.assertResponseCodeEqual(resp, 503)
+        self.assertEqual(json_decode(resp.body), {'ready': False})
+
+        # the request waits for the database to become available
+        request = self.fetch("/db")
+        await asyncio.sleep(0.1)
+        self.assertFalse(request.done())
+        self.assertIsNone(self._app.connection_pool)
+
+        self._app.database_available.set()
+        resp = await request
+        self.assertResponseCodeEqual(resp, 200)
+        self.assertEqual(json_decode(resp.body), {'value': 1})
+        self.assertTrue(self._app.ready)
+
+        resp = await self.fetch("/ready")
+        self.assertResponseCodeEqual(resp, 200)
+        self.assertEqual(json_decode(resp.body), {'ready': True})
@@ -0,0 +1,54 @@
+import asyncio
+
+from .base import AsyncHandlerTest
+
+from asyncbb.jsonrpc import JsonRPCBase
+from asyncbb.websocket import JsonRPCWebSocketHandler
+from tornado.escape import json_decode, json_encode
+from tornado.testing import gen_test
+from tornado.websocket import websocket_connect
+
+class RPC(JsonRPCBase):
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+        return seconds
+
+    async def subscribe(self):
+        self.handler.notify("subscribed", {"ok": True})
+        return True
+
+class Handler(JsonRPCWebSocketHandler):
+
+    def get_rpc(self):
+        return RPC(self)
+
+class WebSocketTest(AsyncHandlerTest):
+
+    def get_urls(self):
+        return [(r'^/ws$', Handler)]
+
+    @gen_test
+    async def test_multiplexed_calls(self):
+
+        con = await websocket_connect(self.get_url('/ws').replace('http', 'ws'))
+
+        con.write_message(json_encode({"jsonrpc": "2.0", "method": "sleep", "params": [0.2], "id": 1}))
+        con.write_message(json_encode({"jsonrpc": "2.0", "method": "sleep", "params": [0], "id": 2}))
+
+        # the second call finishes first
+        resp = json_decode(await con.read_message())
+        self.assertEqual(resp['id'], 2)
+        resp = json_decode(await con.read_message())
+        self.assertEqual(resp['id'], 1)
+        self.assertEqual(resp['result'], 0.2)
+
+        con.write_message(json_encode({"jsonrpc": "2.0", "method": "subscribe", "id": 3}))
+        messages = [json_decode(await con.read_message()) for _ in range(2)]
+        self.assertIn({"jsonrpc": "2.0", "method": "subscribed", "params": {"ok": True}}, messages)
+        self.assertIn({"jsonrpc": "2.0", "result": True, "id": 3}, messages)
+
+        con.close()
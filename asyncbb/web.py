@@ -3,24 +3,36 @@ import concurrent.futures
 import configparser
 import logging
 import os
+import signal
 import tornado.ioloop
 import tornado.options
 import tornado.web
 import sys
 import urllib
+import weakref
 
 from configparser import SectionProxy
-from .log import log, SlackLogHandler, configure_logger
+from .log import log, SlackLogHandler, configure_logger, drain_log_handlers
+from .log import configure_async_logging, stop_async_logging, JSONFormatter, SamplingFilter
+from .ratelimit import MemoryRateLimitStore, RedisRateLimitStore
+from .circuitbreaker import breaker_from_config
+from .loop import setup_event_loop
+from .monitor import LoopMonitor
+from .routing import IndexedRouter
 from tornado.log import app_log, access_log, gen_log
+from tornado.httputil import split_host_and_port
+from tornado.platform.asyncio import to_asyncio_future
+from tornado.web import _unquote_or_none
 
 # verify python version
 if sys.version_info[:2] < (3, 5):
     print("Requires python version 3.5 or greater")
     sys.exit(1)
 
-# install asyncio io loop (NOTE: must be done before app creation
+# install the event loop policy (from the EVENT_LOOP environment
+# variable) and asyncio io loop (NOTE: must be done before app creation
 # as the autoreloader will also install one
-tornado.platform.asyncio.AsyncIOMainLoop().install()
+setup_event_loop()
 
 # extra tornado config options
 tornado.options.define("config", default="config-localhost.ini", help="configuration file")
@@ -39,26 +51,144 @@ class Application(tornado.web.Application):
         if cookie_secret is None:
             cookie_secret = self.config['general'].get('cookie_secret', None)
 
+        # the event loop may also be set in the config file
+        if 'event_loop' in self.config['general']:
+            setup_event_loop(self.config['general']['event_loop'])
+
         super(Application, self).__init__(urls, debug=self.config['general'].getboolean('debug'),
                                           cookie_secret=cookie_secret, **kwargs)
 
         self.asyncio_loop = asyncio.get_event_loop()
+        self.connection_pool = None
+        self.event_bus = None
+        self.redis_connection_pool = None
+        self.job_queue = None
+        self.job_worker = None
+        self.rate_limit_store = MemoryRateLimitStore()
+        # fail fast when the database or redis are failing or timing out
+        self.database_breaker = None
+        self.redis_breaker = None
         if 'database' in self.config:
-            from .database import prepare_database
-            self.connection_pool = self.asyncio_loop.run_until_complete(
-                prepare_database(self.config['database']))
-        else:
-            self.connection_pool = None
-
+            from .database import BREAKER_ERRORS
+            self.database_breaker = breaker_from_config('database', self.config, BREAKER_ERRORS)
         if 'redis' in self.config:
-            from .redis import prepare_redis
-            self.redis_connection_pool = prepare_redis(self.config['redis'])
+            from .redis import BREAKER_ERRORS
+            self.redis_breaker = breaker_from_config('redis', self.config, BREAKER_ERRORS)
 
         max_workers = self.config['executor']['max_workers'] \
                       if 'executor' in self.config and 'max_workers' in self.config['executor'] \
                       else None
         self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
 
+        if 'compression' in self.config and self.config['compression'].getboolean('enabled', True):
+            self.compression = {
+                'min_size': self.config['compression'].getint('min_size', 1024),
+                'offload_size': self.config['compression'].getint('offload_size', 256 * 1024),
+                'level': self.config['compression'].getint('level', 6)
+            }
+        else:
+            self.compression = None
+
+        if 'monitor' in self.config and self.config['monitor'].getboolean('enabled', True):
+            self.loop_monitor = LoopMonitor(self.asyncio_loop,
+                                            interval=self.config['monitor'].getfloat('interval', 0.5),
+                                            threshold=self.config['monitor'].getfloat('threshold', 0.1))
+            # only measures while the loop is running
+            self.loop_monitor.start()
+        else:
+            self.loop_monitor = None
+
+        self.indexed_routing = self.config['general'].getboolean('indexed_routing', False)
+        self.route_cache_size = self.config['general'].getint('route_cache_size', 1024)
+        self._routers = {}
+
+        # set once all the configured subsystems have been initialised
+        self.ready = False
+        self._startup_future = None
+        self._shutdown_future = None
+        self._server = None
+        # handlers for requests that haven't finished yet, used to drain
+        # in-flight requests on shutdown
+        self._active_handlers = weakref.WeakSet()
+        # unless background startup is enabled, block until everything is
+        # up so the application is usable as soon as it's constructed
+        if not self.config['general'].getboolean('background_startup', False):
+            self.asyncio_loop.run_until_complete(self.startup())
+
+    def startup(self):
+        """Starts initialising the application's subsystems (if they
+        haven't been already) and returns a future that resolves when
+        they are all ready"""
+        if self._startup_future is None or \
+           (self._startup_future.done() and self._startup_future.exception() is not None):
+            self._startup_future = asyncio.ensure_future(self._startup(), loop=self.asyncio_loop)
+        return self._startup_future
+
+    async def wait_until_ready(self):
+        if not self.ready:
+            await self.startup()
+
+    async def _startup(self):
+        # bring the subsystems up concurrently, so the slowest one
+        # determines the startup time rather than the sum of all of them
+        tasks = []
+        if 'database' in self.config:
+            tasks.append(self._start_database())
+        if 'redis' in self.config:
+            tasks.append(self._start_redis())
+
+        timeout = self.config['general'].getfloat('startup_timeout', None)
+        try:
+            await asyncio.wait_for(asyncio.gather(*tasks), timeout)
+            if 'jobs' in self.config:
+                await self._start_jobs()
+        except Exception:
+            log.exception("Application startup failed")
+            raise
+        self.ready = True
+        log.info("Application ready")
+
+    async def _start_database(self):
+        if self.connection_pool is not None:
+            return
+        from .database import prepare_database
+        from .events import EventBus
+        self.connection_pool = await prepare_database(self.config['database'])
+        self.event_bus = EventBus(self.config['database'], self.connection_pool)
+
+    async def _start_redis(self):
+        if self.redis_connection_pool is not None:
+            return
+        from .redis import prepare_redis, warmup_redis
+        pool = prepare_redis(self.config['redis'])
+        warmup = self.config['redis'].get('warmup_connections', None)
+        if warmup:
+            # opening connections with the sync client blocks, so do it off loop
+            await self.asyncio_loop.run_in_executor(self.executor, warmup_redis, pool, int(warmup))
+        self.redis_connection_pool = pool
+        if 'ratelimit' in self.config and self.config['ratelimit'].get('store') == 'redis':
+            self.rate_limit_store = RedisRateLimitStore(pool, self.executor)
+
+    async def _start_jobs(self):
+        if self.job_queue is not None:
+            return
+        from .jobs import JobQueue, Worker, PostgresJobStore, RedisJobStore
+        config = self.config['jobs']
+        if config.get('store', 'postgres' if self.connection_pool is not None else 'redis') == 'redis':
+            store = RedisJobStore(self.redis_connection_pool, self.executor)
+        else:
+            store = PostgresJobStore(self.connection_pool)
+        await store.setup()
+        self.job_queue = JobQueue(store)
+        if config.getboolean('worker', False):
+            self.job_worker = Worker(self.job_queue,
+                                     concurrency=config.getint('concurrency', 4),
+                                     poll_interval=config.getfloat('poll_interval', 1.0),
+                                     visibility_timeout=config.getfloat('visibility_timeout', 60.0),
+                                     max_attempts=config.getint('max_attempts', 5),
+                                     executor=self.executor)
+            self.job_worker.start()
+
     def process_config(self):
 
         tornado.options.parse_command_line()
@@ -90,9 +220,43 @@ class Application(tornado.web.Application):
         if 'REDIS_URL' in os.environ:
             config['redis'] = {'url': os.environ['REDIS_URL']}
 
+        if 'database' in config:
+            if 'DATABASE_POOL_MIN_SIZE' in os.environ:
+                config['database']['min_size'] = os.environ['DATABASE_POOL_MIN_SIZE']
+            if 'DATABASE_POOL_MAX_SIZE' in os.environ:
+                config['database']['max_size'] = os.environ['DATABASE_POOL_MAX_SIZE']
+
+        if 'JOB_WORKER' in os.environ:
+            config.setdefault('jobs', SectionProxy(config, 'jobs'))['worker'] = os.environ['JOB_WORKER']
+        if 'JOB_WORKER_CONCURRENCY' in os.environ:
+            config.setdefault('jobs', SectionProxy(config, 'jobs'))['concurrency'] = os.environ['JOB_WORKER_CONCURRENCY']
+
         if 'EXECUTOR_MAX_WORKERS' in os.environ:
             config['executor'] = {'max_workers': os.environ['EXECUTOR_MAX_WORKERS']}
 
+        if 'BACKGROUND_STARTUP' in os.environ:
+            config['general']['background_startup'] = os.environ['BACKGROUND_STARTUP']
+        if 'STARTUP_TIMEOUT' in os.environ:
+            config['general']['startup_timeout'] = os.environ['STARTUP_TIMEOUT']
+
+        if 'COMPRESSION_MIN_SIZE' in os.environ:
+            config.setdefault('compression', SectionProxy(config, 'compression'))['min_size'] = os.environ['COMPRESSION_MIN_SIZE']
+
+        if 'INDEXED_ROUTING' in os.environ:
+            config['general']['indexed_routing'] = os.environ['INDEXED_ROUTING']
+
+        if 'LOOP_MONITOR_THRESHOLD' in os.environ:
+            config.setdefault('monitor', SectionProxy(config, 'monitor'))['threshold'] = os.environ['LOOP_MONITOR_THRESHOLD']
+
+        if 'EVENT_LOOP' in os.environ:
+            config['general']['event_loop'] = os.environ['EVENT_LOOP']
+
+        if 'REQUEST_TIMEOUT' in os.environ:
+            config['general']['request_timeout'] = os.environ['REQUEST_TIMEOUT']
+
+        if 'SHUTDOWN_TIMEOUT' in os.environ:
+            config['general']['shutdown_timeout'] = os.environ['SHUTDOWN_TIMEOUT']
+
         if 'COOKIE_SECRET' in os.environ:
             config['general']['cookie_secret'] = os.environ['COOKIE_SECRET']
 
@@ -118,6 +282,22 @@ class Application(tornado.web.Application):
             else:
                 log.warning("log level is set in config but does not match one of `DEBUG`, `INFO`, `WARNING`, `ERROR`, `CRITICAL`")
 
+        if 'LOG_FORMAT' in os.environ:
+            config.setdefault('logging', SectionProxy(config, 'logging'))['format'] = os.environ['LOG_FORMAT']
+        if 'LOG_ASYNC' in os.environ:
+            config.setdefault('logging', SectionProxy(config, 'logging'))['async'] = os.environ['LOG_ASYNC']
+        if 'ACCESS_LOG_SAMPLE_RATE' in os.environ:
+            config.setdefault('logging', SectionProxy(config, 'logging'))['access_log_sample_rate'] = os.environ['ACCESS_LOG_SAMPLE_RATE']
+
+        if 'logging' in config:
+            if config['logging'].getboolean('async', False):
+                configure_async_logging(json_format=config['logging'].get('format') == 'json')
+            elif config['logging'].get('format') == 'json':
+                for handler in logging.getLogger().handlers:
+                    handler.setFormatter(JSONFormatter())
+            if 'access_log_sample_rate' in config['logging']:
+                access_log.addFilter(SamplingFilter(config['logging'].getfloat('access_log_sample_rate')))
+
         # configure default torando loggers
         configure_logger(app_log)
         configure_logger(gen_log)
@@ -125,23 +305,156 @@ class Application(tornado.web.Application):
 
         return config
 
+    def _get_router(self, handlers):
+        router = self._routers.get(id(handlers))
+        # handlers may have been added to the list since the router was built
+        if router is None or router.size != len(handlers):
+            router = self._routers[id(handlers)] = IndexedRouter(handlers, self.route_cache_size)
+        return router
+
+    def _get_host_routers(self, request):
+        """the same as tornado's `_get_host_handlers` but returning the
+        router for each of the matching host's handler lists"""
+        host = split_host_and_port(request.host.lower())[0]
+        routers = [self._get_router(handlers) for pattern, handlers in self.handlers
+                   if pattern.match(host)]
+        # Look for default host if not behind load balancer (for debugging)
+        if not routers and "X-Real-Ip" not in request.headers:
+            routers = [self._get_router(handlers) for pattern, handlers in self.handlers
+                       if pattern.match(self.default_host)]
+        return routers
+
+    def listen(self, *args, **kwargs):
+        self._server = super(Application, self).listen(*args, **kwargs)
+        return self._server
+
+    def start_request(self, server_conn, request_conn):
+        return _RequestDispatcher(self, request_conn)
+
+    def log_request(self, handler):
+        super(Application, self).log_request(handler)
+        self._active_handlers.discard(handler)
+
     def start(self):
         self.listen(tornado.options.options.port, xheaders=True)
         log.info("Starting HTTP Server on port: {}".format(tornado.options.options.port))
+        if not self.ready:
+            # background startup: finish initialising while accepting connections
+            self.startup()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            self.asyncio_loop.add_signal_handler(sig, self._handle_shutdown_signal, sig)
         self.asyncio_loop.run_forever()
 
+    def _handle_shutdown_signal(self, sig):
+        if self._shutdown_future is not None:
+            # a second signal skips the graceful shutdown
+            log.warning("Received signal {} during shutdown, stopping immediately".format(sig))
+            self.asyncio_loop.stop()
+            return
+        log.info("Received signal {}, shutting down".format(sig))
+        self._shutdown_future = asyncio.ensure_future(self.shutdown(), loop=self.asyncio_loop)
+        self._shutdown_future.add_done_callback(lambda f: self.asyncio_loop.stop())
+
+    async def shutdown(self, timeout=None):
+        """Stops accepting new connections, waits for in-flight requests and
+        database transactions to finish, then closes all the application's
+        resources. Everything must complete within `timeout` seconds (the
+        `shutdown_timeout` config option, 30 seconds by default) after which
+        the remaining resources are closed forcefully"""
+
+        if timeout is None:
+            timeout = self.config['general'].getfloat('shutdown_timeout', 30.0)
+        deadline = self.asyncio_loop.time() + timeout
+
+        def remaining():
+            return max(deadline - self.asyncio_loop.time(), 0)
+
+        self.ready = False
+        if self._server is not None:
+            self._server.stop()
+
+        # drain in-flight requests
+        while self._active_handlers and remaining() > 0:
+            await asyncio.sleep(0.1)
+        if self._active_handlers:
+            log.warning("Shutdown timeout reached with {} requests still in progress".format(
+                len(self._active_handlers)))
+        if self._server is not None:
+            await to_asyncio_future(self._server.close_all_connections())
+
+        if self.job_worker is not None:
+            await self.job_worker.stop(remaining())
+
+        if self.event_bus is not None:
+            await self.event_bus.close()
+
+        if self.connection_pool is not None:
+            from .database import close_pool
+            await close_pool(self.connection_pool, remaining())
+
+        if self.redis_connection_pool is not None:
+            self.redis_connection_pool.disconnect()
+
+        try:
+            await asyncio.wait_for(
+                self.asyncio_loop.run_in_executor(None, self.executor.shutdown),
+                remaining())
+        except asyncio.TimeoutError:
+            log.warning("Shutdown timeout reached with executor tasks still running")
+
+        await drain_log_handlers(log, remaining())
+
+        if self.loop_monitor is not None:
+            self.loop_monitor.stop()
+
+        stop_async_logging()
+
+        log.info("Shutdown complete")
+
 
 class _RequestDispatcher(tornado.web._RequestDispatcher):
     def set_request(self, request):
         super(_RequestDispatcher, self).set_request(request)
 
-class DebuggingApplication(Application):
+    def _find_handler(self):
+        if not self.application.indexed_routing:
+            return super(_RequestDispatcher, self)._find_handler()
+        app = self.application
+        routers = app._get_host_routers(self.request)
+        if not routers:
+            # let tornado deal with redirecting to the default host
+            return super(_RequestDispatcher, self)._find_handler()
+        for router in routers:
+            route = router.find(self.request.path)
+            if route is None:
+                continue
+            spec, match = route
+            self.handler_class = spec.handler_class
+            self.handler_kwargs = spec.kwargs
+            if spec.regex.groups:
+                # see tornado.web._RequestDispatcher._find_handler
+                if spec.regex.groupindex:
+                    self.path_kwargs = dict(
+                        (str(k), _unquote_or_none(v))
+                        for (k, v) in match.groupdict().items())
+                else:
+                    self.path_args = [_unquote_or_none(s)
+                                      for s in match.groups()]
+            return
+        if app.settings.get('default_handler_class'):
+            self.handler_class = app.settings['default_handler_class']
+            self.handler_kwargs = app.settings.get('default_handler_args', {})
+        else:
+            self.handler_class = tornado.web.ErrorHandler
+            self.handler_kwargs = dict(status_code=404)
 
-    def listen(self, *args, **kwargs):
-        self._server = super(DebuggingApplication, self).listen(*args, **kwargs)
+    def execute(self):
+        rval = super(_RequestDispatcher, self).execute()
+        if not self.handler._finished:
+            self.application._active_handlers.add(self.handler)
+        return rval
 
-    def start_request(self, server_conn, request_conn):
-        return _RequestDispatcher(self, request_conn)
+class DebuggingApplication(Application):
 
     def log_request(self, handler):
         super(DebuggingApplication, self).log_request(handler)
@@ -152,3 +465,10 @@ class DebuggingApplication(Application):
             size,
             self.connection_pool._con_count
         ))
+        for breaker in (self.database_breaker, self.redis_breaker):
+            if breaker is not None:
+                access_log.info("Circuit breaker '{}': {state}, calls: {calls}, failures: {failures}, opened: {opened_count}, rejected: {rejected_count}".format(
+                    breaker.name, **breaker.stats()))
+        if self.loop_monitor is not None:
+            access_log.info("Event loop lag: {lag:.3f}s, average: {avg_lag:.3f}s, max: {max_lag:.3f}s, blocked: {blocked_count}".format(
+                **self.loop_monitor.stats()))
@@ -0,0 +1,90 @@
+import asyncio
+import tornado.escape
+import tornado.iostream
+import tornado.websocket
+
+from tornado.platform.asyncio import to_asyncio_future
+
+class JsonRPCWebSocketHandler(tornado.websocket.WebSocketHandler):
+    """Serves a `JsonRPCBase` over a websocket connection.
+
+    Each message is handled as a json rpc request (or batch), with up to
+    `max_concurrent` of them running at once per connection. Responses are
+    sent as soon as each call completes, so they may arrive out of order
+    and should be matched to calls using their id. A call's slot is only
+    freed once its response has been written to the socket, so slow
+    clients don't cause responses to build up in memory. Messages arriving
+    when `max_pending` calls are already queued or running are rejected
+    with a "Server busy" error.
+
+    Subclasses set `rpc_class`, or override `get_rpc` to construct the
+    rpc object for the connection. `notify` sends notifications to the
+    client."""
+
+    rpc_class = None
+    max_concurrent = 16
+    max_pending = 256
+
+    def get_rpc(self):
+        return self.rpc_class()
+
+    def open(self, *args, **kwargs):
+        self.rpc = self.get_rpc()
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._tasks = set()
+
+    def on_message(self, message):
+        if len(self._tasks) >= self.max_pending:
+            self._reject(message)
+            return
+        task = asyncio.ensure_future(self._handle_message(message))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _reject(self, message):
+        try:
+            request = tornado.escape.json_decode(message)
+        except ValueError:
+            request = None
+        request_id = request.get('id') if isinstance(request, dict) else None
+        self.write_message(self.encode({
+            "jsonrpc": "2.0",
+            "error": {
+                "code": -32000,
+                "message": "Server busy",
+                "data": None
+            },
+            "id": request_id
+        }))
+
+    async def _handle_message(self, message):
+        async with self._semaphore:
+            response = await self.rpc(message)
+            if response is not None:
+                await self._write(response)
+
+    def encode(self, response):
+        return self.rpc.encode(response)
+
+    async def _write(self, response):
+        try:
+            future = self.write_message(self.encode(response))
+        except tornado.websocket.WebSocketClosedError:
+            return
+        if future is not None:
+            try:
+                await to_asyncio_future(future)
+            except tornado.iostream.StreamClosedError:
+                pass
+
+    def notify(self, method, params=None):
+        """Sends a json rpc notification to the client, returning a future
+        that resolves once it has been written"""
+        message = {"jsonrpc": "2.0", "method": method}
+        if params is not None:
+            message["params"] = params
+        return asyncio.ensure_future(self._write(message))
+
+    def on_close(self):
+        for task in list(getattr(self, '_tasks', ())):
+            task.cancel()